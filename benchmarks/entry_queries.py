@@ -0,0 +1,144 @@
+"""
+Measures the queries made against entries on a large dataset, with and
+without the composite indexes on ``FormEntry`` and ``FieldEntry``,
+which are only declared on Django 1.5 or later. Run with the settings
+of a project that has ``forms_builder.forms`` installed, eg::
+
+    DJANGO_SETTINGS_MODULE=settings python benchmarks/entry_queries.py
+
+A test database is created and destroyed for the run.
+"""
+from __future__ import print_function, unicode_literals
+
+from datetime import timedelta
+from optparse import OptionParser
+from random import Random
+from time import time
+
+
+def build(options):
+    """
+    Create the forms, fields and entries, with entries spread evenly
+    across the forms and over the last year.
+    """
+    from django.contrib.auth.models import User
+    from forms_builder.forms.fields import TEXT
+    from forms_builder.forms.models import (Form, FormEntry, FieldEntry,
+                                            STATUS_PUBLISHED)
+    from forms_builder.forms.utils import now
+    user = User.objects.create_user("benchmark", "", "benchmark")
+    forms = []
+    for i in range(options.forms):
+        form = Form.objects.create(title="Benchmark %s" % i,
+                                   status=STATUS_PUBLISHED)
+        field_ids = [form.fields.create(label="Field %s" % j,
+                                        field_type=TEXT).id
+                     for j in range(options.fields)]
+        forms.append((form, field_ids))
+    start = now() - timedelta(days=365)
+    step = timedelta(days=365) / options.entries
+    for first in range(0, options.entries, options.batch_size):
+        entries = []
+        field_entries = []
+        for i in range(first, min(first + options.batch_size,
+                                  options.entries)):
+            form, field_ids = forms[i % len(forms)]
+            entries.append(FormEntry(id=i + 1, form=form, user=user,
+                                     entry_time=start + step * i))
+            for field_id in field_ids:
+                field_entries.append(FieldEntry(entry_id=i + 1,
+                                                field_id=field_id,
+                                                value="Value %s" % i))
+        FormEntry.objects.bulk_create(entries)
+        FieldEntry.objects.bulk_create(field_entries)
+    return forms, start
+
+
+def measure(options, forms, start):
+    """
+    Return the average time in milliseconds taken by each query.
+    """
+    from forms_builder.forms.models import FormEntry, FieldEntry
+    random = Random(0)
+    timings = []
+
+    def timed(name, query):
+        began = time()
+        for _ in range(options.repeat):
+            query()
+        timings.append((name, (time() - began) * 1000 / options.repeat))
+
+    def answer():
+        form, field_ids = random.choice(forms)
+        entry_id = random.randint(1, options.entries)
+        list(FieldEntry.objects.filter(entry_id=entry_id,
+                                       field_id=random.choice(field_ids)))
+
+    def entries_in_range():
+        form, _ = random.choice(forms)
+        since = start + timedelta(days=random.randint(0, 358))
+        FormEntry.objects.filter(form=form, entry_time__gte=since,
+            entry_time__lt=since + timedelta(days=7)).count()
+
+    def latest_answers():
+        form, field_ids = random.choice(forms)
+        list(FieldEntry.objects.filter(entry__form=form).order_by(
+            "-entry__id").select_related("entry")[:len(field_ids) * 50])
+
+    timed("Answer by entry and field", answer)
+    timed("Entries for a form in a week", entries_in_range)
+    timed("Latest answers for a form", latest_answers)
+    return timings
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--entries", type="int", default=1000000,
+                      help="Number of entries to create.")
+    parser.add_option("--forms", type="int", default=10,
+                      help="Number of forms the entries are spread across.")
+    parser.add_option("--fields", type="int", default=5,
+                      help="Number of fields in each form.")
+    parser.add_option("--repeat", type="int", default=100,
+                      help="Number of times each query is timed.")
+    parser.add_option("--batch-size", type="int", default=5000,
+                      help="Number of entries inserted at once.")
+    options, _ = parser.parse_args()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    from south.db import db
+    from south.management.commands import patch_for_test_db_setup
+    from forms_builder.forms.models import FormEntry, FieldEntry
+    setup_test_environment()
+    # Create the tables from the models without the composite indexes,
+    # which are then added once the queries have been timed without
+    # them.
+    settings.SOUTH_TESTS_MIGRATE = False
+    patch_for_test_db_setup()
+    indexes = []
+    for model in (FormEntry, FieldEntry):
+        for names in model._meta.index_together:
+            columns = [model._meta.get_field(name).column for name in names]
+            indexes.append((model._meta.db_table, columns))
+        model._meta.index_together = ()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        began = time()
+        forms, start = build(options)
+        print("Created %s entries in %.1fs" % (options.entries,
+                                               time() - began))
+        without = measure(options, forms, start)
+        for table, columns in indexes:
+            db.create_index(table, columns)
+        with_indexes = measure(options, forms, start)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    print("%-30s %12s %12s" % ("Query (ms)", "Without", "With"))
+    for (name, before), (_, after) in zip(without, with_indexes):
+        print("%-30s %12.3f %12.3f" % (name, before, after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures how many new entries per second ``FormForForm`` can save for a
+form with many fields. Run with the settings of a project that has
+``forms_builder.forms`` installed, eg::
+
+    DJANGO_SETTINGS_MODULE=settings python benchmarks/submissions.py
+
+A test database is created and destroyed for the run.
+"""
+from __future__ import print_function, unicode_literals
+
+from optparse import OptionParser
+from time import time
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--fields", type="int", default=50,
+                      help="Number of fields in the form.")
+    parser.add_option("--submissions", type="int", default=500,
+                      help="Number of entries to save.")
+    options, _ = parser.parse_args()
+
+    from django.conf import settings
+    from django.db import connection, reset_queries
+    from django.template import Context
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    try:
+        from south.management.commands import patch_for_test_db_setup
+    except ImportError:
+        pass
+    else:
+        patch_for_test_db_setup()
+    settings.DEBUG = True
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        from django.contrib.auth.models import User
+        from forms_builder.forms.fields import TEXT
+        from forms_builder.forms.forms import FormForForm
+        from forms_builder.forms.models import Form, STATUS_PUBLISHED
+        user = User.objects.create_user("benchmark", "", "benchmark")
+        form = Form.objects.create(title="Benchmark", status=STATUS_PUBLISHED)
+        data = {}
+        for i in range(options.fields):
+            field = form.fields.create(label="Field %s" % i, field_type=TEXT)
+            data[field.slug] = "Value %s" % i
+        form = Form.objects.get(id=form.id)
+        context = Context({"user": user})
+        queries = 0
+        start = time()
+        for _ in range(options.submissions):
+            form_for_form = FormForForm(form, context, data)
+            form_for_form.is_valid()
+            reset_queries()
+            form_for_form.save()
+            queries += len(connection.queries)
+        elapsed = time() - start
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    print("%s fields, %s submissions in %.2fs" % (options.fields,
+                                                  options.submissions,
+                                                  elapsed))
+    print("%.1f submissions/s, %.1f queries/submission" % (
+        options.submissions / elapsed, float(queries) / options.submissions))
+
+
+if __name__ == "__main__":
+    main()
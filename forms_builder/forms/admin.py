@@ -5,27 +5,36 @@ from future.builtins import bytes, open
 
 from csv import writer
 from mimetypes import guess_type
-from os.path import join
+from os.path import basename, getsize, join
 from datetime import datetime
-from io import BytesIO, StringIO
+from io import BytesIO
+from itertools import chain, islice
 from json import loads
+from wsgiref.util import FileWrapper
 
 from django.conf.urls import patterns, url
 from django.contrib import admin
-from django.core.files.storage import FileSystemStorage
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ValidationError
-from django.db.models import Count
+from django.db.models import Count, Max, Min
 from django.http import HttpResponse, HttpResponseRedirect
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:  # Django < 1.5
+    # Iterators given as the content are streamed as it's read.
+    StreamingHttpResponse = HttpResponse
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
 from django.utils.translation import ungettext, ugettext_lazy as _
 from django.forms.models import BaseInlineFormSet
 
 from forms_builder.forms.forms import EntriesForm
-from forms_builder.forms.models import Form, Field, FormEntry, FieldEntry
-from forms_builder.forms.settings import CSV_DELIMITER, UPLOAD_ROOT
+from forms_builder.forms.models import (Form, Field, FormEntry, FieldEntry,
+                                        FormSnapshot)
+from forms_builder.forms.settings import CSV_DELIMITER, ENTRIES_PER_PAGE
+from forms_builder.forms.settings import USE_SNAPSHOTS
 from forms_builder.forms.settings import USE_SITES, EDITABLE_SLUGS
+from forms_builder.forms.uploads import fs, storage_name
 from forms_builder.forms.utils import now, slugify
 from forms_builder.forms import fields
 
@@ -37,7 +46,6 @@ except ImportError:
     XLWT_INSTALLED = False
 
 
-fs = FileSystemStorage(location=UPLOAD_ROOT)
 form_admin_filter_horizontal = ()
 form_admin_fieldsets = [
     (None, {"fields": ("title", "template", ("status", "login_required",),
@@ -56,6 +64,16 @@ if USE_SITES:
     form_admin_filter_horizontal = ("sites",)
 
 
+class EchoBuffer(object):
+    """
+    File-like object that returns what's written to it, so that rows
+    written by a CSV writer can be streamed as they're written.
+    """
+
+    def write(self, value):
+        return value
+
+
 class FieldFormSet(BaseInlineFormSet):
     """
     Validation of the form fields
@@ -147,6 +165,14 @@ class FormAdmin(admin.ModelAdmin):
         qs = super(FormAdmin, self).queryset(request)
         return qs.annotate(total_entries=Count("entries"))
 
+    def save_related(self, request, form, formsets, change):
+        """
+        Freeze the form once its fields have been saved too.
+        """
+        super(FormAdmin, self).save_related(request, form, formsets, change)
+        if USE_SNAPSHOTS:
+            FormSnapshot.objects.take(form.instance)
+
     def get_urls(self):
         """
         Add the entries view to urls.
@@ -190,26 +216,25 @@ class FormAdmin(admin.ModelAdmin):
         export_xls = export_xls or request.POST.get("export_xls")
         if submitted:
             if export:
-                response = HttpResponse(mimetype="text/csv")
-                fname = "%s-%s.csv" % (form.slug, slugify(now().ctime()))
-                attachment = "attachment; filename=%s" % fname
-                response["Content-Disposition"] = attachment
-                queue = StringIO()
+                # Each row is sent as soon as it's written, with the
+                # entries read in chunks as the rows are streamed.
+                echo = EchoBuffer()
                 try:
-                    csv = writer(queue, delimiter=CSV_DELIMITER)
+                    csv = writer(echo, delimiter=CSV_DELIMITER)
                     writerow = csv.writerow
                 except TypeError:
-                    queue = BytesIO()
                     delimiter = bytes(CSV_DELIMITER, encoding="utf-8")
-                    csv = writer(queue, delimiter=delimiter)
+                    csv = writer(echo, delimiter=delimiter)
                     writerow = lambda row: csv.writerow(
                         [c.encode("utf-8") if hasattr(c, "encode")
                          else c for c in row])
-                writerow(entries_form.columns())
-                for row in entries_form.rows(csv=True):
-                    writerow(row)
-                data = queue.getvalue()
-                response.write(data)
+                rows = chain([entries_form.columns()],
+                             entries_form.rows(csv=True))
+                response = StreamingHttpResponse(
+                    (writerow(row) for row in rows), content_type="text/csv")
+                fname = "%s-%s.csv" % (form.slug, slugify(now().ctime()))
+                attachment = "attachment; filename=%s" % fname
+                response["Content-Disposition"] = attachment
                 return response
             elif XLWT_INSTALLED and export_xls:
                 response = HttpResponse(mimetype="application/vnd.ms-excel")
@@ -248,11 +273,31 @@ class FormAdmin(admin.ModelAdmin):
                         message = ungettext("1 entry deleted",
                                             "%(count)s entries deleted", count)
                         info(request, message % {"count": count})
+        # Show a page of rows for the entries with IDs lower than the
+        # last one shown, which stays correct as new entries are added.
+        rows = []
+        before = next_before = entries_count = None
+        if submitted:
+            try:
+                before = int(request.POST.get("before") or
+                             request.GET.get("before"))
+            except (TypeError, ValueError):
+                pass
+            rows = entries_form.rows(before=before,
+                                     chunk_size=ENTRIES_PER_PAGE + 1)
+            rows = list(islice(rows, ENTRIES_PER_PAGE + 1))
+            if len(rows) > ENTRIES_PER_PAGE:
+                rows = rows[:ENTRIES_PER_PAGE]
+                next_before = rows[-1][0]
+            entries_count = entries_form.count()
         template = "admin/forms/entries.html"
         context = {"title": _("View Entries"), "entries_form": entries_form,
                    "opts": self.model._meta, "original": form,
                    "can_delete_entries": can_delete_entries,
-                   "submitted": submitted,
+                   "submitted": submitted, "rows": rows, "before": before,
+                   "next_before": next_before,
+                   "entries_count": entries_count,
+                   "count_approximate": entries_form.filtered_in_python(),
                    "xlwt_installed": XLWT_INSTALLED}
         return render_to_response(template, context, RequestContext(request))
 
@@ -262,13 +307,79 @@ class FormAdmin(admin.ModelAdmin):
         """
         model = self.fieldentry_model
         field_entry = get_object_or_404(model, id=field_entry_id)
-        path = join(fs.location, field_entry.value)
-        response = HttpResponse(mimetype=guess_type(path)[0])
-        f = open(path, "r+b")
-        response["Content-Disposition"] = "attachment; filename=%s" % f.name
-        response.write(f.read())
-        f.close()
+        path = join(fs.location, storage_name(field_entry.value))
+        name = basename(field_entry.value)
+        # Streamed in chunks so large uploads aren't read into memory.
+        f = open(path, "rb")
+        response = StreamingHttpResponse(FileWrapper(f),
+                                         content_type=guess_type(name)[0])
+        response["Content-Disposition"] = "attachment; filename=%s" % name
+        response["Content-Length"] = getsize(path)
         return response
 
 
+class ScoreListFilter(admin.SimpleListFilter):
+    """
+    Filter entries by quarters of the range of their stored scores,
+    among the entries of the form filtered by, if any. Each quarter
+    includes its lower bound, and the last one its upper bound too.
+    """
+
+    title = _("score")
+    parameter_name = "score"
+    ranges = 4
+
+    def lookups(self, request, model_admin):
+        entries = model_admin.queryset(request)
+        form_id = request.GET.get("form__id__exact")
+        if form_id:
+            entries = entries.filter(form__id=form_id)
+        bounds = entries.aggregate(low=Min("score"), high=Max("score"))
+        low, high = bounds["low"], bounds["high"]
+        if low is None:
+            return []
+        step = (high - low) / self.ranges or 1
+        lookups = []
+        for i in range(self.ranges):
+            start = low + step * i
+            end = start + step
+            if i == self.ranges - 1 or end >= high:
+                # Open ended, so that the highest score is included.
+                lookups.append(("%s:" % start, "%g - %g" % (start, high)))
+                break
+            lookups.append(("%s:%s" % (start, end),
+                            "%g - %g" % (start, end)))
+        return lookups
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            start, end = self.value().split(":")
+            queryset = queryset.filter(score__gte=float(start))
+            if end:
+                queryset = queryset.filter(score__lt=float(end))
+        except ValueError:
+            return queryset
+        return queryset
+
+
+class FormEntryAdmin(admin.ModelAdmin):
+    """
+    Lists entries with their stored scores, which can be sorted and
+    filtered on in the database.
+    """
+
+    list_display = ("id", "form", "user", "entry_time", "score")
+    list_filter = ("form", ScoreListFilter)
+    list_select_related = True
+    date_hierarchy = "entry_time"
+    readonly_fields = ("form", "snapshot", "user", "entry_time", "score",
+                       "score_breakdown")
+
+    def has_add_permission(self, request):
+        return False
+
+
 admin.site.register(Form, FormAdmin)
+admin.site.register(FormEntry, FormEntryAdmin)
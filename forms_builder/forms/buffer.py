@@ -0,0 +1,205 @@
+from __future__ import unicode_literals
+
+import sqlite3
+from json import dumps, loads
+from logging import getLogger
+from threading import local
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection
+from django.utils.dateparse import parse_datetime
+try:
+    from django.db.transaction import atomic
+except ImportError:  # Django < 1.6
+    from django.db.transaction import commit_on_success as atomic
+
+from forms_builder.forms import settings
+from forms_builder.forms.signals import buffered_form_valid
+from forms_builder.forms.utils import now
+
+
+logger = getLogger("forms_builder")
+
+# Errors that may mean a buffered submission can never be saved. When
+# a submission saved on its own raises a database error, it's only
+# moved aside if the database is still reachable.
+SAVE_ERRORS = (DatabaseError, ValueError)
+
+
+def database_available():
+    """
+    Return True if queries can still be run on the database.
+    """
+    try:
+        connection.cursor().execute("SELECT 1")
+    except DatabaseError:
+        return False
+    return True
+
+
+class SubmissionBuffer(object):
+    """
+    Durable queue of validated submissions in a local SQLite database,
+    written to by the buffered form view and flushed into ``FormEntry``
+    and ``FieldEntry`` rows in batches by the ``flush_form_submissions``
+    management command. Only one flusher should run per buffer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = local()
+
+    @property
+    def connection(self):
+        """
+        One connection per thread, in autocommit mode and with every
+        write synced to disk before it returns.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            if not self.path:
+                raise ImproperlyConfigured("The "
+                    "FORMS_BUILDER_SUBMISSION_BUFFER_PATH setting must be "
+                    "set to buffer submissions.")
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            connection.execute("CREATE TABLE IF NOT EXISTS submissions "
+                               "(id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "data TEXT NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS "
+                               "failed_submissions (id INTEGER PRIMARY KEY, "
+                               "data TEXT NOT NULL, error TEXT NOT NULL)")
+            self.local.connection = connection
+        return connection
+
+    def append(self, form_for_form):
+        """
+        Store the values of the given valid ``FormForForm``, saving any
+        uploads, and return the unsaved ``FormEntry`` for them.
+        """
+        from forms_builder.forms.forms import stored_value
+        from forms_builder.forms.models import FormEntry
+        entry = FormEntry(form=form_for_form.form,
+                          entry_time=now(), user=form_for_form.user)
+        entry.snapshot_id = getattr(form_for_form.form, "snapshot_id", None)
+        values = [(field_id, stored_value(value))
+                  for field_id, value in form_for_form.entry_values()]
+        slugs = dict((f.id, f.slug) for f in form_for_form.plan.fields)
+        form_for_form.changed_fields = set(slugs[field_id]
+                                           for field_id, _ in values)
+        data = {"form_id": entry.form_id, "snapshot_id": entry.snapshot_id,
+                "user_id": entry.user_id, "entry_time": entry.entry_time,
+                "values": values}
+        self.connection.execute("INSERT INTO submissions (data) VALUES (?)",
+                                (dumps(data, cls=DjangoJSONEncoder),))
+        return entry
+
+    def count(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM submissions").fetchone()[0]
+
+    def failed(self):
+        """
+        Return the ID, data and error of each submission that couldn't
+        be saved.
+        """
+        return self.connection.execute("SELECT id, data, error FROM "
+                                       "failed_submissions ORDER BY id"
+                                       ).fetchall()
+
+    def flush(self, batch_size):
+        """
+        Save up to ``batch_size`` of the oldest submissions in a single
+        transaction, with the field entries for all of them created in
+        one ``bulk_create``, then remove them from the buffer and send
+        ``buffered_form_valid`` for each entry. Returns the entries
+        saved. Submissions are removed once their entries are
+        committed, so a crash in between can only save a submission
+        twice, never lose it. If the batch can't be saved, each
+        submission is saved in a transaction of its own, and those that
+        still can't be, such as one whose form has since been deleted,
+        are moved to the ``failed_submissions`` table with their error.
+        Database errors while the database can't be reached are raised,
+        leaving the submissions in the buffer for the next flush.
+        """
+        rows = self.connection.execute("SELECT id, data FROM submissions "
+                                       "ORDER BY id LIMIT ?",
+                                       (batch_size,)).fetchall()
+        if not rows:
+            return []
+        failed = []
+        try:
+            with atomic():
+                entries = self.save_rows(rows)
+        except SAVE_ERRORS:
+            entries = []
+            for row in rows:
+                try:
+                    with atomic():
+                        entries.extend(self.save_rows([row]))
+                except SAVE_ERRORS as e:
+                    if (isinstance(e, DatabaseError) and
+                            not database_available()):
+                        raise
+                    failed.append(row + ("%s: %s" % (type(e).__name__, e),))
+        self.connection.execute("BEGIN")
+        try:
+            self.connection.executemany("INSERT OR REPLACE INTO "
+                                        "failed_submissions "
+                                        "(id, data, error) VALUES (?, ?, ?)",
+                                        failed)
+            self.connection.execute("DELETE FROM submissions WHERE id <= ?",
+                                    (rows[-1][0],))
+        except:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        for row_id, _, error in failed:
+            logger.error("Buffered submission %s failed: %s" % (row_id,
+                                                               error))
+        for entry in entries:
+            buffered_form_valid.send(sender=self, entry=entry)
+        return entries
+
+    def save_rows(self, rows):
+        """
+        Save the entries for the given buffered submissions, raising
+        ``ValueError`` for any whose form or user no longer exists.
+        """
+        from django.contrib.auth.models import User
+        from forms_builder.forms.models import Form, FormEntry, FieldEntry
+        submitted = [(row_id, loads(data)) for row_id, data in rows]
+        form_ids = set(Form.objects.filter(id__in=set(
+            data["form_id"] for _, data in submitted)).values_list(
+            "id", flat=True))
+        user_ids = set(User.objects.filter(id__in=set(
+            data["user_id"] for _, data in submitted)).values_list(
+            "id", flat=True))
+        entries = []
+        field_entries = []
+        for row_id, data in submitted:
+            if data["form_id"] not in form_ids:
+                raise ValueError("The form for submission %s no longer "
+                                 "exists" % row_id)
+            if data["user_id"] not in user_ids:
+                raise ValueError("The user for submission %s no longer "
+                                 "exists" % row_id)
+            entry = FormEntry(form_id=data["form_id"],
+                              snapshot_id=data["snapshot_id"],
+                              user_id=data["user_id"],
+                              entry_time=parse_datetime(data["entry_time"]))
+            entry.save()
+            entries.append(entry)
+            for field_id, value in data["values"]:
+                field_entries.append(FieldEntry(entry=entry,
+                                                field_id=field_id,
+                                                value=value))
+        FieldEntry.objects.bulk_create(field_entries)
+        FormEntry.objects.save_scores(entries)
+        return entries
+
+
+submissions = SubmissionBuffer(settings.SUBMISSION_BUFFER_PATH)
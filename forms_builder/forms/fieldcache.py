@@ -0,0 +1,144 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from threading import Lock, local
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.core.signals import request_started
+
+from forms_builder.forms import settings
+
+
+# Cache key shared between processes holding the current version of
+# the fields table, which changes whenever a field is saved or deleted.
+VERSION_CACHE_KEY = "forms_builder.field_cache.version"
+
+
+class FieldCache(object):
+    """
+    Identity map of ``Field`` instances by ID, used when attributes of
+    a field entry are read from its field. Fields are kept per thread
+    for the duration of each request, and when ``process`` is True,
+    also shared by every thread of the process until the version held
+    in Django's cache backend changes, which is checked as each request
+    starts. Each map holds at most ``size`` fields, dropping the least
+    recently used.
+    """
+
+    def __init__(self, size, process=False):
+        self.size = size
+        self.process = process
+        self.local = local()
+        self.lock = Lock()
+        self.fields = OrderedDict()
+        self.version = None
+
+    @property
+    def request_fields(self):
+        fields = getattr(self.local, "fields", None)
+        if fields is None:
+            fields = self.local.fields = OrderedDict()
+        return fields
+
+    def start_request(self, **kwargs):
+        """
+        Forget the fields used by the thread's last request, and those
+        shared by the process if the fields table has changed since.
+        """
+        self.local.fields = OrderedDict()
+        if not self.process:
+            return
+        version = cache.get(VERSION_CACHE_KEY)
+        if version is None:
+            version = invalidate_fields()
+        if version != self.version:
+            with self.lock:
+                self.fields.clear()
+                self.version = version
+
+    def get_many(self, field_ids):
+        """
+        Return a dict of the fields with the given IDs, loading those
+        not already cached with a single query.
+        """
+        from forms_builder.forms.models import Field
+        found = {}
+        request_fields = self.request_fields
+        for field_id in set(field_ids):
+            field = request_fields.get(field_id)
+            if field is None and self.process:
+                with self.lock:
+                    field = self.fields.get(field_id)
+                    if field is not None:
+                        del self.fields[field_id]
+                        self.fields[field_id] = field
+            if field is not None:
+                found[field_id] = field
+        missing = [field_id for field_id in set(field_ids)
+                   if field_id not in found]
+        if missing:
+            loaded = Field.objects.in_bulk(missing)
+            found.update(loaded)
+            if self.process:
+                with self.lock:
+                    self.add(self.fields, loaded)
+        self.add(request_fields, found)
+        return found
+
+    def get(self, field_id):
+        """
+        Return the field with the given ID.
+        """
+        from forms_builder.forms.models import Field
+        try:
+            return self.get_many([field_id])[field_id]
+        except KeyError:
+            raise Field.DoesNotExist("Field matching query does not exist.")
+
+    def add(self, fields, added):
+        """
+        Add the given dict of fields to the given map, dropping the least
+        recently used fields once it holds more than ``size``.
+        """
+        for field_id, field in added.items():
+            fields.pop(field_id, None)
+            fields[field_id] = field
+        while len(fields) > self.size:
+            fields.popitem(last=False)
+
+    def clear(self):
+        self.local.fields = OrderedDict()
+        with self.lock:
+            self.fields.clear()
+
+
+field_cache = FieldCache(settings.FIELD_CACHE_SIZE,
+                         settings.USE_PROCESS_FIELD_CACHE)
+
+request_started.connect(field_cache.start_request)
+
+
+def attach_fields(field_entries):
+    """
+    Load the fields of the given field entries in bulk and attach each
+    to its entry, so that reading field attributes from the entries
+    doesn't query each field. Returns the entries as a list.
+    """
+    field_entries = list(field_entries)
+    fields = field_cache.get_many([f.field_id for f in field_entries])
+    for field_entry in field_entries:
+        field_entry.__dict__["_field"] = fields.get(field_entry.field_id)
+    return field_entries
+
+
+def invalidate_fields():
+    """
+    Drop the fields cached by this process, signal every other process
+    to drop theirs as their next request starts, and return the new
+    version.
+    """
+    field_cache.clear()
+    version = uuid4().hex
+    cache.set(VERSION_CACHE_KEY, version, None)
+    return version
@@ -3,27 +3,34 @@
 from __future__ import unicode_literals
 from future.builtins import int, range, str
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from hashlib import md5
 from os.path import join, split
 from uuid import uuid4
 
 import django
 from django import forms
+from django.core.cache import cache
+try:
+    from django.db.transaction import atomic
+except ImportError:  # Django < 1.6
+    from django.db.transaction import commit_on_success as atomic
 from django.forms.extras import SelectDateWidget
-from django.core.files.storage import FileSystemStorage
 from django.core.urlresolvers import reverse
-from django.template import Template
+from django.http import Http404
+from django.db.models import Q
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
 from forms_builder.forms import fields
 from forms_builder.forms.models import FormEntry, FieldEntry
 from forms_builder.forms import settings
-from forms_builder.forms.utils import now, split_choices
+from forms_builder.forms.plans import get_form_plan, render_default
+from forms_builder.forms.uploads import (fs, is_blob, release_blob,
+                                         release_upload, store_blob)
+from forms_builder.forms.utils import bulk_update, now, split_choices
 
 
-fs = FileSystemStorage(location=settings.UPLOAD_ROOT)
-
 ##############################
 # Each type of export filter #
 ##############################
@@ -105,6 +112,34 @@ FILTER_FUNCS = {
         lambda val, field: set(val) != set(split_choices(field)),
 }
 
+
+def between_excludes(val_from, val_to):
+    """
+    Match date values outside the given range, comparing only the date
+    part of date/time values as the filter function does.
+    """
+    between = Q()
+    if val_from:
+        between &= Q(value__gte=val_from.isoformat())
+    if val_to:
+        between &= Q(value__lt=(val_to + timedelta(days=1)).isoformat())
+    return ~between
+
+
+# The lookups matching field entry values that fail each filter type,
+# for the filters that can be checked in the database. Filters on
+# fields with multiple values per entry are always checked with the
+# filter functions.
+FILTER_EXCLUDES = {
+    FILTER_CHOICE_CONTAINS: lambda val: ~Q(value__icontains=val),
+    FILTER_CHOICE_DOESNT_CONTAIN: lambda val: Q(value__icontains=val),
+    FILTER_CHOICE_EQUALS: lambda val: ~Q(value__iexact=val),
+    FILTER_CHOICE_DOESNT_EQUAL: lambda val: Q(value__iexact=val),
+    FILTER_CHOICE_BETWEEN: between_excludes,
+    FILTER_CHOICE_CONTAINS_ANY: lambda val: ~Q(value__in=val),
+    FILTER_CHOICE_DOESNT_CONTAIN_ANY: lambda val: Q(value__in=val),
+}
+
 # Export form fields for each filter type grouping
 text_filter_field = forms.ChoiceField(label=" ", required=False,
                                       choices=TEXT_FILTER_CHOICES)
@@ -116,12 +151,21 @@ date_filter_field = forms.ChoiceField(label=" ", required=False,
                                       choices=DATE_FILTER_CHOICES)
 
 
+def stored_value(value):
+    """
+    Return the given cleaned value as it's stored in a field entry.
+    """
+    if value is not None and not isinstance(value, str):
+        value = str(value)
+    return value
+
+
 class FormForForm(forms.ModelForm):
     field_entry_model = FieldEntry
 
     class Meta:
         model = FormEntry
-        exclude = ("user", "form", "entry_time")
+        exclude = ("user", "form", "entry_time", "snapshot")
 
     def __init__(self, form, context, *args, **kwargs):
         """
@@ -131,7 +175,10 @@ class FormForForm(forms.ModelForm):
         # request = context.get('request', None)
         self.user = context.get('user', None)
         self.form = form
-        self.form_fields = form.fields.visible()
+        self.plan = get_form_plan(form)
+        self.changed_fields = set()
+        self.stored_files = {}
+        self.form_fields = self.get_form_fields()
         initial = kwargs.pop("initial", {})
         # If a FormEntry instance is given to edit, stores it's field
         # values for using as initial data.
@@ -139,23 +186,14 @@ class FormForForm(forms.ModelForm):
         if kwargs.get("instance"):
             for field_entry in kwargs["instance"].fields.all():
                 field_entries[field_entry.field_id] = field_entry.value
+        self.current_values = field_entries
         super(FormForForm, self).__init__(*args, **kwargs)
-        # Create the form fields.
+        # Create the form fields from the form's compiled plan.
         for field in self.form_fields:
             field_key = field.slug
             field_class = fields.CLASSES[field.field_type]
             field_widget = fields.WIDGETS.get(field.field_type)
-            field_args = {"label": field.label, "required": field.required,
-                          "help_text": field.help_text}
-            arg_names = field_class.__init__.__code__.co_varnames
-            if "max_length" in arg_names:
-                field_args["max_length"] = settings.FIELD_MAX_LENGTH
-            if "choices" in arg_names:
-                choices = list(field.get_choices())
-                if (field.field_type == fields.SELECT and
-                        field.default not in [c[0] for c in choices]):
-                    choices.insert(0, ("", field.placeholder_text))
-                field_args["choices"] = choices
+            field_args = dict(field.args)
             # if field_widget is not None:
             if isinstance(field_widget, forms.Widget):
                 field_args["widget"] = field_widget
@@ -177,7 +215,7 @@ class FormForForm(forms.ModelForm):
                 try:
                     initial_val = initial[field_key]
                 except KeyError:
-                    initial_val = Template(field.default).render(context)
+                    initial_val = render_default(field, context)
             if initial_val:
                 if field.is_a(*fields.MULTIPLE):
                     initial_val = split_choices(initial_val)
@@ -191,51 +229,111 @@ class FormForForm(forms.ModelForm):
                 years = list(range(now.year, now.year - 120, -1))
                 self.fields[field_key].widget.years = years
 
-            # Add identifying CSS classes to the field.
-            css_class = field_class.__name__.lower()
-            if field.required:
-                css_class += " required"
-                if (settings.USE_HTML5 and
-                    field.field_type != fields.CHECKBOX_MULTIPLE):
-                    self.fields[field_key].widget.attrs["required"] = ""
-            self.fields[field_key].widget.attrs["class"] = css_class
-            if field.placeholder_text and not field.default:
-                text = field.placeholder_text
-                self.fields[field_key].widget.attrs["placeholder"] = text
+            # Add identifying CSS classes and HTML5 attributes.
+            self.fields[field_key].widget.attrs.update(field.attrs)
 
-    def save(self, **kwargs):
+    def get_form_fields(self):
         """
-        Get/create a FormEntry instance and assign submitted values to
-        related FieldEntry instances for each form field.
+        Return the plans of the fields to build.
         """
-        entry = super(FormForForm, self).save(commit=False)
-        entry.form = self.form
-        entry.user = self.user
-        entry.entry_time = now()
-        entry.save()
-        entry_fields = entry.fields.values_list("field_id", flat=True)
-        new_entry_fields = []
+        return self.plan.fields
+
+    def entry_values(self):
+        """
+        Return pairs of field IDs and the values to store for them,
+        saving any uploaded files.
+        """
+        values = []
         for field in self.form_fields:
             field_key = field.slug
             value = self.cleaned_data[field_key]
             if value and self.fields[field_key].widget.needs_multipart_form:
-                value = fs.save(join("forms", str(uuid4()), value.name), value)
+                if settings.CONTENT_ADDRESSED_UPLOADS:
+                    current = self.current_values.get(field.id)
+                    value = store_blob(value, replacing=current)
+                else:
+                    value = fs.save(join("forms", str(uuid4()), value.name),
+                                    value)
+                self.stored_files[field_key] = value
             if isinstance(value, list):
                 value = ", ".join([v.strip() for v in value])
-            if field.id in entry_fields:
-                field_entry = entry.fields.get(field_id=field.id)
-                field_entry.value = value
-                field_entry.save()
+            values.append((field.id, value))
+        return values
+
+    def save(self, **kwargs):
+        """
+        Get/create a FormEntry instance and assign submitted values to
+        related FieldEntry instances for each form field. When editing
+        an entry, only the values that changed are written, and the
+        slugs of their fields are stored in ``changed_fields``.
+        """
+        entry = super(FormForForm, self).save(commit=False)
+        editing = entry.pk is not None
+        entry.form = self.form
+        entry.snapshot_id = getattr(self.form, "snapshot_id", None)
+        entry.user = self.user
+        entry.entry_time = now()
+        with atomic():
+            entry.save()
+            if editing:
+                self.update_field_entries(entry)
             else:
-                new = {"entry": entry, "field_id": field.id, "value": value}
+                self.create_field_entries(entry)
+            entry.save_score()
+        return entry
+
+    def create_field_entries(self, entry):
+        """
+        Create the field entries for a new entry in a single query.
+        """
+        slugs = dict((f.id, f.slug) for f in self.plan.fields)
+        new_entry_fields = []
+        self.changed_fields = set()
+        for field_id, value in self.entry_values():
+            new = {"entry": entry, "field_id": field_id, "value": value}
+            new_entry_fields.append(self.field_entry_model(**new))
+            self.changed_fields.add(slugs[field_id])
+        self.bulk_create(new_entry_fields)
+
+    def update_field_entries(self, entry):
+        """
+        Write the values that changed for an existing entry, creating
+        field entries for any fields it didn't have values for.
+        """
+        # Not loaded via entry.fields, which would set the entry on
+        # each field entry and make them look up their field.
+        existing = self.field_entry_model.objects.filter(entry=entry)
+        field_entries = dict((f.field_id, f) for f in existing)
+        slugs = dict((f.id, f.slug) for f in self.plan.fields)
+        new_entry_fields = []
+        updated = {}
+        replaced_blobs = []
+        self.changed_fields = set()
+        for field_id, value in self.entry_values():
+            field_entry = field_entries.get(field_id)
+            if field_entry is None:
+                new = {"entry": entry, "field_id": field_id, "value": value}
                 new_entry_fields.append(self.field_entry_model(**new))
-        if new_entry_fields:
-            if django.VERSION >= (1, 4, 0):
-                self.field_entry_model.objects.bulk_create(new_entry_fields)
+            elif field_entry.value != stored_value(value):
+                updated[field_entry.id] = stored_value(value)
+                if is_blob(field_entry.value):
+                    replaced_blobs.append(field_entry.value)
             else:
-                for field_entry in new_entry_fields:
-                    field_entry.save()
-        return entry
+                continue
+            self.changed_fields.add(slugs[field_id])
+        bulk_update(self.field_entry_model, "value", updated)
+        self.bulk_create(new_entry_fields)
+        for value in replaced_blobs:
+            release_blob(value)
+
+    def bulk_create(self, field_entries):
+        if not field_entries:
+            return
+        if django.VERSION >= (1, 4, 0):
+            self.field_entry_model.objects.bulk_create(field_entries)
+        else:
+            for field_entry in field_entries:
+                field_entry.save()
 
     def email_to(self):
         """
@@ -245,7 +343,120 @@ class FormForForm(forms.ModelForm):
             if field.is_a(fields.EMAIL):
                 return self.cleaned_data[field.slug]
         return None
- 
+
+
+class PagedFormForForm(FormForForm):
+    """
+    Only builds, validates and saves the fields on one page of the
+    form, as grouped by each field's ``merge`` value. Values entered
+    on each page are kept in ``storage`` until the last page is saved,
+    which defaults to the session of the request in the context.
+    """
+
+    def __init__(self, form, context, *args, **kwargs):
+        self.page = kwargs.pop("page", 0)
+        self.storage = kwargs.pop("storage", None)
+        if self.storage is None:
+            session = context["request"].session
+            key = "forms_builder_pages_%s" % form.id
+            self.storage = session.setdefault(key, {})
+            session.modified = True
+        super(PagedFormForForm, self).__init__(form, context, *args, **kwargs)
+        # Uploads are stored as each page is posted, so those for a
+        # page posted again replace the ones kept in storage.
+        self.current_values.update((int(field_id), value) for field_id, value
+                                   in self.storage.items())
+
+    def get_form_fields(self):
+        """
+        Return the plans of the fields on the current page, raising
+        Http404 for a page the form doesn't have.
+        """
+        if not self.plan.pages and self.page == 0:
+            return ()
+        if not 0 <= self.page < len(self.plan.pages):
+            raise Http404
+        slugs = set(self.plan.pages[self.page])
+        return tuple(f for f in self.plan.fields if f.slug in slugs)
+
+    def is_last_page(self):
+        return self.page == len(self.plan.pages) - 1
+
+    def first_incomplete_page(self):
+        """
+        Return the number of the first page before the current one with
+        a required field that has no value in storage, or None if they
+        were all completed.
+        """
+        for page, slugs in enumerate(self.plan.pages[:self.page]):
+            for field in self.plan.fields:
+                if (field.slug in slugs and dict(field.args)["required"] and
+                        not self.storage.get(str(field.id))):
+                    return page
+        return None
+
+    def clean(self):
+        """
+        Don't accept the last page until every earlier page has been
+        completed, setting ``incomplete_page`` to the first one that
+        wasn't so that the view can send the user back to it.
+        """
+        cleaned_data = super(PagedFormForForm, self).clean()
+        self.incomplete_page = None
+        if self.is_last_page():
+            self.incomplete_page = self.first_incomplete_page()
+            if self.incomplete_page is not None:
+                raise forms.ValidationError(
+                    _("Page %s of the form hasn't been completed.") %
+                    (self.incomplete_page + 1))
+        return cleaned_data
+
+    def store_page(self):
+        """
+        Keep the values entered on the current page in storage, as the
+        strings they'll be saved as, releasing any uploads stored when
+        the page was posted before.
+        """
+        file_ids = set(f.id for f in self.form_fields if f.is_a(fields.FILE))
+        for field_id, value in super(PagedFormForForm, self).entry_values():
+            value = stored_value(value)
+            previous = self.storage.get(str(field_id))
+            if field_id in file_ids and previous and previous != value:
+                release_upload(previous)
+            self.storage[str(field_id)] = value
+
+    def entry_values(self):
+        """
+        Return the values stored for every page of the form.
+        """
+        self.store_page()
+        return [(f.id, self.storage.get(str(f.id)))
+                for f in self.plan.fields]
+
+    def save(self, **kwargs):
+        """
+        Store the current page, saving the entry once the last page
+        has been submitted.
+        """
+        if not self.is_last_page():
+            self.store_page()
+            return None
+        entry = super(PagedFormForForm, self).save(**kwargs)
+        self.storage.clear()
+        return entry
+
+    def email_to(self):
+        """
+        Return the value entered for the first field of type EmailField
+        on any page.
+        """
+        for field in self.plan.fields:
+            if field.is_a(fields.EMAIL):
+                if field in self.form_fields:
+                    return self.cleaned_data[field.slug]
+                return self.storage.get(str(field.id))
+        return None
+
 
 class EntriesForm(forms.Form):
     """
@@ -353,9 +564,100 @@ class EntriesForm(forms.Form):
             fields.append(self.entry_time_name)
         return fields
 
-    def rows(self, csv=False):
+    def excluded_entries(self, field):
+        """
+        Returns a queryset of the IDs of entries whose value for the
+        given field fails its filter, or None if the field isn't
+        filtered or its filter can't be checked in the database.
+        """
+        filter_type = self.posted_data("field_%s_filter" % field.id)
+        if filter_type not in FILTER_EXCLUDES or field.is_a(*fields.MULTIPLE):
+            return None
+        if filter_type == FILTER_CHOICE_BETWEEN:
+            filter_args = [self.posted_data("field_%s_from" % field.id),
+                           self.posted_data("field_%s_to" % field.id)]
+            if not any(filter_args):
+                return None
+        else:
+            filter_args = self.posted_data("field_%s_contains" % field.id)
+            if not filter_args:
+                return None
+            filter_args = [filter_args]
+        values = FILTER_EXCLUDES[filter_type](*filter_args)
+        return self.fieldentry_model.objects.filter(values,
+            field_id=field.id).values("entry_id")
+
+    def entries(self):
+        """
+        Returns the form's entries, leaving out those failing the
+        filters that can be checked in the database.
+        """
+        entries = self.formentry_model.objects.filter(form=self.form)
+        if self.posted_data("field_0_filter") == FILTER_CHOICE_BETWEEN:
+            time_from = self.posted_data("field_0_from")
+            time_to = self.posted_data("field_0_to")
+            if time_from and time_to:
+                entries = entries.filter(
+                    entry_time__range=(time_from, time_to))
+        for field in self.form_fields:
+            excluded = self.excluded_entries(field)
+            if excluded is not None:
+                entries = entries.exclude(id__in=excluded)
+        return entries
+
+    def filtered_in_python(self):
         """
-        Returns each row based on the selected criteria.
+        Returns True if any of the filters are only checked as each
+        row is built, so that counting ``entries()`` overestimates the
+        number of rows.
+        """
+        for field in self.form_fields:
+            if (field.is_a(*fields.MULTIPLE) and
+                    self.posted_data("field_%s_filter" % field.id) and
+                    self.posted_data("field_%s_contains" % field.id)):
+                return True
+        return False
+
+    def count(self):
+        """
+        Returns the number of entries passing the filters checked in
+        the database, cached for ``ENTRIES_COUNT_CACHE_TIMEOUT`` seconds
+        since counting is slow on forms with many entries.
+        """
+        entries = self.entries()
+        if not settings.ENTRIES_COUNT_CACHE_TIMEOUT:
+            return entries.count()
+        query = str(entries.values("id").query).encode("utf-8")
+        cache_key = "forms_builder.entries_count.%s" % md5(query).hexdigest()
+        count = cache.get(cache_key)
+        if count is None:
+            count = entries.count()
+            cache.set(cache_key, count, settings.ENTRIES_COUNT_CACHE_TIMEOUT)
+        return count
+
+    def field_entries(self, entries, chunk_size):
+        """
+        Yields the field entries of the given entries, newest entry
+        first, loading ``chunk_size`` entries at a time by ID so that
+        reading further ahead never repeats or skips entries, even as
+        new ones are added.
+        """
+        entries = entries.order_by("-id")
+        while True:
+            entry_ids = list(entries.values_list("id", flat=True)[:chunk_size])
+            if not entry_ids:
+                break
+            field_entries = self.fieldentry_model.objects.filter(
+                entry_id__in=entry_ids).order_by("-entry__id").select_related(
+                "entry__user")
+            for field_entry in field_entries:
+                yield field_entry
+            entries = entries.filter(id__lt=entry_ids[-1])
+
+    def rows(self, csv=False, before=None, chunk_size=500):
+        """
+        Returns each row based on the selected criteria, for the
+        entries with IDs lower than ``before`` if given.
         """
 
         # Store the index of each field against its ID for building each
@@ -377,17 +679,15 @@ class EntriesForm(forms.Form):
         if include_entry_time:
             num_columns += 1
 
-        # Get the field entries for the given form and filter by entry_time
-        # if specified.
-        model = self.fieldentry_model
-        field_entries = model.objects.filter(entry__form=self.form
-            ).order_by("-entry__id").select_related("entry")
-        if self.posted_data("field_0_filter") == FILTER_CHOICE_BETWEEN:
-            time_from = self.posted_data("field_0_from")
-            time_to = self.posted_data("field_0_to")
-            if time_from and time_to:
-                field_entries = field_entries.filter(
-                    entry__entry_time__range=(time_from, time_to))
+        # Load the entries passing the filters that can be checked in
+        # the database, so that only their rows are built and checked
+        # against the other filters.
+        entries = self.entries()
+        if before is not None:
+            entries = entries.filter(id__lt=before)
+        field_entries = self.field_entries(entries, chunk_size)
+        filtered_in_db = set(field.id for field in self.form_fields
+                             if self.excluded_entries(field) is not None)
 
         # Loop through each field value ordered by entry, building up each
         # entry as a row. Use the ``valid_row`` flag for marking a row as
@@ -413,7 +713,7 @@ class EntriesForm(forms.Form):
             field_id = field_entry.field_id
             filter_type = self.posted_data("field_%s_filter" % field_id)
             filter_args = None
-            if filter_type:
+            if filter_type and field_id not in filtered_in_db:
                 if filter_type == FILTER_CHOICE_BETWEEN:
                     f, t = "field_%s_from" % field_id, "field_%s_to" % field_id
                     filter_args = [self.posted_data(f), self.posted_data(t)]
@@ -0,0 +1,155 @@
+from __future__ import unicode_literals
+
+from datetime import timedelta
+from threading import Lock, local
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import connection
+try:
+    from django.db.transaction import on_commit
+except ImportError:  # Django < 1.9
+    on_commit = None
+
+from forms_builder.forms import settings
+from forms_builder.forms.utils import now
+
+
+# Cache key shared between processes holding the current version of
+# the forms table, which changes whenever a form is saved or deleted.
+VERSION_CACHE_KEY = "forms_builder.published_index.version"
+
+
+class PublishedFormIndex(object):
+    """
+    Per process index of form slugs, answering whether a form is
+    published for the current site without querying the database. The
+    index is reloaded when the version held in Django's cache backend
+    changes, and the set of published forms is recomputed in memory
+    at the next publish or expiry date of any form. The index is shared
+    by the threads of the process, and only changed with its lock held.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.forms = {}
+        self.published = {}
+        self.expires = None
+
+    def load(self, version):
+        """
+        Load the publishing settings and sites of every form. Called
+        with the lock held.
+        """
+        from forms_builder.forms.models import Form, STATUS_PUBLISHED
+        sites = {}
+        if settings.USE_SITES:
+            through = Form.sites.through.objects.values_list("form_id",
+                                                             "site_id")
+            for form_id, site_id in through:
+                sites.setdefault(form_id, set()).add(site_id)
+        columns = ("id", "slug", "status", "publish_date", "expiry_date")
+        forms = {}
+        for form_id, slug, status, publish_date, expiry_date in \
+                Form.objects.values_list(*columns):
+            if status != STATUS_PUBLISHED:
+                publish_date = expiry_date = None
+            forms[slug] = (form_id, status == STATUS_PUBLISHED,
+                           publish_date, expiry_date,
+                           sites.get(form_id, set()))
+        self.forms = forms
+        self.version = version
+        self.refresh()
+
+    def refresh(self):
+        """
+        Work out which forms are published right now, and when that
+        next changes. Called with the lock held.
+        """
+        from django.contrib.sites.models import Site
+        site_id = None
+        if settings.USE_SITES:
+            site_id = Site.objects.get_current().id
+        current = now()
+        published = {}
+        boundaries = []
+        for slug, (form_id, status, publish_date, expiry_date,
+                   sites) in self.forms.items():
+            if not status or (site_id is not None and site_id not in sites):
+                continue
+            if publish_date is not None and publish_date > current:
+                boundaries.append(publish_date)
+                continue
+            if expiry_date is not None:
+                if expiry_date < current:
+                    continue
+                # Forms are still published at their expiry date.
+                boundaries.append(expiry_date + timedelta(microseconds=1))
+            published[slug] = form_id
+        self.published = published
+        self.expires = min(boundaries) if boundaries else None
+
+    def get(self, slug, for_user=None):
+        """
+        Return the ID of the form with the given slug if it's published
+        for the given user, otherwise None. Staff can see all forms.
+        """
+        version = cache.get(VERSION_CACHE_KEY)
+        if version is None:
+            version = new_version()
+        with self.lock:
+            if version != self.version:
+                self.load(version)
+            elif self.expires is not None and now() >= self.expires:
+                self.refresh()
+            forms, published = self.forms, self.published
+        if for_user is not None and for_user.is_staff:
+            try:
+                return forms[slug][0]
+            except KeyError:
+                return None
+        return published.get(slug)
+
+
+published_forms = PublishedFormIndex()
+
+# Whether the thread's request has changed forms inside a transaction,
+# without on_commit to invalidate the index once it's committed.
+pending = local()
+
+
+def new_version():
+    """
+    Signal every process to reload its index of published forms, and
+    return the new version.
+    """
+    version = uuid4().hex
+    cache.set(VERSION_CACHE_KEY, version, None)
+    return version
+
+
+def invalidate_published_index(**kwargs):
+    """
+    Signal every process to reload its index of published forms once
+    the current transaction is committed, so that none of them load
+    rows the transaction hasn't committed yet and keep them until the
+    next change. Without ``on_commit``, the index is invalidated now,
+    and again once the request has finished, by when its transaction
+    has been committed.
+    """
+    if on_commit is not None:
+        on_commit(new_version)
+        return
+    new_version()
+    if getattr(connection, "in_atomic_block", False):
+        pending.invalidate = True
+
+
+def invalidate_pending(**kwargs):
+    if getattr(pending, "invalidate", False):
+        pending.invalidate = False
+        new_version()
+
+request_finished.connect(invalidate_pending)
@@ -0,0 +1,71 @@
+from __future__ import unicode_literals
+
+from logging import getLogger
+from optparse import make_option
+from time import sleep
+
+from django.core.management.base import NoArgsCommand
+from django.db import DatabaseError, connection
+
+from forms_builder.forms import settings
+from forms_builder.forms.buffer import submissions
+
+
+logger = getLogger("forms_builder")
+
+# Longest wait in seconds between attempts to flush a batch while the
+# database is failing.
+MAX_RETRY_DELAY = 300
+
+
+class Command(NoArgsCommand):
+    """
+    Saves the submissions buffered by the buffered form view, in
+    batches of up to ``--batch-size`` entries per transaction. Runs
+    until stopped, checking the buffer every ``--interval`` seconds,
+    which bounds how long a submission waits to be saved. Database
+    errors are logged and the batch retried, waiting twice as long
+    after each failure in a row, up to five minutes.
+    """
+
+    help = "Saves buffered form submissions."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--batch-size", type="int",
+                    default=settings.SUBMISSION_BATCH_SIZE,
+                    help="Maximum number of entries saved per transaction."),
+        make_option("--interval", type="float",
+                    default=settings.SUBMISSION_FLUSH_INTERVAL,
+                    help="Seconds to wait for submissions once the buffer "
+                         "is empty."),
+        make_option("--once", action="store_true", default=False,
+                    help="Exit once the buffer is empty."),
+    )
+
+    def handle_noargs(self, **options):
+        batch_size = options["batch_size"]
+        saved = 0
+        failures = 0
+        while True:
+            try:
+                flushed = len(submissions.flush(batch_size))
+            except DatabaseError:
+                if options["once"]:
+                    raise
+                failures += 1
+                delay = min(options["interval"] * 2 ** failures,
+                            MAX_RETRY_DELAY)
+                logger.exception("Flushing buffered submissions failed, "
+                                 "retrying in %.1fs" % delay)
+                # Reconnect on the next attempt.
+                connection.close()
+                sleep(delay)
+                continue
+            failures = 0
+            saved += flushed
+            if flushed == batch_size:
+                continue
+            if options["once"]:
+                break
+            sleep(options["interval"])
+        self.stdout.write("Saved %s entries" % saved)
@@ -0,0 +1,100 @@
+from __future__ import unicode_literals
+
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+from time import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from forms_builder.forms.models import Form, FormEntry
+from forms_builder.forms.utils import import_rule
+
+
+def score_entries(entry_ids):
+    """
+    Store the scores of the entries with the given IDs, returning the
+    last ID and the number of entries scored. Run in the worker
+    processes.
+    """
+    entries = list(FormEntry.objects.filter(id__in=entry_ids))
+    FormEntry.objects.save_scores(entries)
+    return entry_ids[-1], len(entries)
+
+
+def close_connection():
+    """
+    Stop worker processes sharing the connection of the process they
+    were forked from.
+    """
+    connection.close()
+
+
+class Command(BaseCommand):
+    """
+    Stores the score given by its rule to each entry of a form, after
+    the rule has changed. Entries are read in chunks of IDs, scored
+    across a pool of processes and written back with a single query
+    per column and chunk. Progress is reported as the last entry ID
+    stored, which can be given to ``--after`` to resume an interrupted
+    run.
+    """
+
+    args = "<form slug>"
+    help = "Stores the scores of every entry of a form."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--chunk-size", type="int", default=500,
+                    help="Number of entries scored by a process at once."),
+        make_option("--processes", type="int", default=cpu_count(),
+                    help="Number of processes to score entries in, or 0 to "
+                         "score them in this process."),
+        make_option("--after", type="int", default=0,
+                    help="Only score entries with an ID greater than this."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("A form slug is required.")
+        try:
+            form = Form.objects.get(slug=args[0])
+        except Form.DoesNotExist:
+            raise CommandError("No form with the slug %s." % args[0])
+        if import_rule(form.slug) is None:
+            raise CommandError("The form %s has no rule." % form.slug)
+        chunks = self.chunks(form, options["chunk_size"], options["after"])
+        pool = None
+        if options["processes"] > 0:
+            close_connection()
+            pool = Pool(options["processes"], initializer=close_connection)
+            results = pool.imap(score_entries, chunks)
+        else:
+            results = (score_entries(chunk) for chunk in chunks)
+        start = time()
+        total = 0
+        try:
+            for last_id, count in results:
+                total += count
+                rate = total / max(time() - start, 0.001)
+                self.stdout.write("Scored %s entries up to ID %s, "
+                                  "%.1f entries/s" % (total, last_id, rate))
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def chunks(self, form, chunk_size, after):
+        """
+        Yield lists of entry IDs for the form in ascending order.
+        """
+        entries = FormEntry.objects.filter(form=form).order_by("id")
+        while True:
+            entry_ids = list(entries.filter(id__gt=after).values_list(
+                "id", flat=True)[:chunk_size])
+            if not entry_ids:
+                break
+            yield entry_ids
+            after = entry_ids[-1]
@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+
+from optparse import make_option
+from threading import Thread
+
+from django.core.mail import get_connection
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+
+from forms_builder.forms.models import EmailJob
+
+
+class Command(NoArgsCommand):
+    """
+    Sends the emails queued when ``FORMS_BUILDER_QUEUE_EMAILS`` is set.
+    Each worker reuses a single connection to the mail server for all
+    the emails it sends. Emails that fail are retried on a later run,
+    once their retry delay has passed.
+    """
+
+    help = "Sends queued form emails."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--workers", type="int", default=1,
+                    help="Number of mail server connections to send "
+                         "emails over in parallel."),
+        make_option("--batch-size", type="int", default=100,
+                    help="Number of emails loaded from the outbox at once."),
+    )
+
+    def handle_noargs(self, **options):
+        workers = max(options["workers"], 1)
+        sent = failed = 0
+        while True:
+            jobs = list(EmailJob.objects.due()[:options["batch_size"]])
+            if not jobs:
+                break
+            results = [[0, 0] for _ in range(workers)]
+            if workers == 1:
+                self.send_jobs(jobs, results[0])
+            else:
+                threads = [Thread(target=self.send_jobs,
+                                  args=(jobs[i::workers], results[i], True))
+                           for i in range(workers)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            sent += sum(result[0] for result in results)
+            failed += sum(result[1] for result in results)
+        self.stdout.write("Sent %s emails, %s failed" % (sent, failed))
+
+    def send_jobs(self, jobs, result, in_thread=False):
+        """
+        Send each of the given jobs not claimed by another worker,
+        adding the number sent and failed to ``result``.
+        """
+        mail_connection = get_connection()
+        try:
+            try:
+                mail_connection.open()
+            except Exception:
+                # Each email will try to connect again, and be retried
+                # later with the error recorded if it can't.
+                pass
+            for job in jobs:
+                if not job.claim():
+                    continue
+                if job.send(connection=mail_connection):
+                    result[0] += 1
+                else:
+                    result[1] += 1
+        finally:
+            mail_connection.close()
+            if in_thread:
+                connection.close()
@@ -2,22 +2,41 @@
 
 from __future__ import unicode_literals
 
+from datetime import timedelta
+from logging import getLogger
+
+import django
 from django.contrib.sites.models import Site
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete
+try:
+    from django.db.transaction import atomic
+except ImportError:  # Django < 1.6
+    from django.db.transaction import commit_on_success as atomic
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext, ugettext_lazy as _
+from email_extras.utils import send_mail_template
 from future.builtins import str
-from json import loads
+from json import dumps, loads
 
 from forms_builder.forms import fields
 from forms_builder.forms import settings
+from forms_builder.forms.fieldcache import field_cache, invalidate_fields
+from forms_builder.forms.index import invalidate_published_index
+from forms_builder.forms.plans import invalidate_form_plan
+from forms_builder.forms.uploads import attachment, is_blob, release_blob
 from forms_builder.forms.utils import (now, slugify, unique_slug,
-                                       get_templates_choices, import_rule)
+                                       bulk_update, get_templates_choices,
+                                       has_rule, import_rule, parse_choices)
 from django.contrib.auth.models import User
 
 
+logger = getLogger("forms_builder")
+
+
 STATUS_DRAFT = 1
 STATUS_PUBLISHED = 2
 STATUS_CHOICES = (
@@ -42,6 +61,25 @@ class FormManager(models.Manager):
             filters.append(Q(sites=Site.objects.get_current()))
         return self.filter(*filters)
 
+    def published_with_fields(self, for_user=None):
+        """
+        Published forms with their fields loaded along with them.
+        """
+        return self.with_fields(self.published(for_user=for_user))
+
+    def with_fields(self, queryset=None):
+        """
+        Load the fields, and any relations given by the
+        ``FORMS_BUILDER_FORM_SELECT_RELATED`` setting, along with the
+        given forms (or all forms) so that displaying a form takes a
+        fixed number of queries.
+        """
+        if queryset is None:
+            queryset = self.all()
+        if settings.FORM_SELECT_RELATED:
+            queryset = queryset.select_related(*settings.FORM_SELECT_RELATED)
+        return queryset.prefetch_related("fields")
+
 
 ######################################################################
 #                                                                    #
@@ -97,6 +135,8 @@ class AbstractForm(models.Model):
     email_message = models.TextField(_("Message"), blank=True)
     template = models.CharField(max_length=50, choices=get_templates_choices(),
                                 blank=True, null=True)
+    revision = models.PositiveIntegerField(default=0, editable=False)
+    updated = models.DateTimeField(null=True, editable=False)
 
     objects = FormManager()
 
@@ -116,7 +156,41 @@ class AbstractForm(models.Model):
         if not self.slug:
             slug = slugify(self)
             self.slug = unique_slug(self.__class__.objects, "slug", slug)
-        super(AbstractForm, self).save(*args, **kwargs)
+        with atomic():
+            self.updated = now()
+            self.revision = self.next_revision()
+            super(AbstractForm, self).save(*args, **kwargs)
+        invalidate_form_plan(self.id)
+        invalidate_published_index()
+
+    def delete(self, *args, **kwargs):
+        invalidate_form_plan(self.id)
+        super(AbstractForm, self).delete(*args, **kwargs)
+        invalidate_published_index()
+
+    def bump_revision(self):
+        """
+        Called when one of the form's fields changes, so that anything
+        cached against the form's revision is no longer used.
+        """
+        with atomic():
+            self.updated = now()
+            self.revision = self.next_revision(updated=self.updated)
+        invalidate_form_plan(self.id)
+
+    def next_revision(self, **values):
+        """
+        Increment the form's revision in the database, along with
+        updating any other given values, and return the new revision.
+        Incrementing in the database means that an instance loaded
+        before one of its fields changed never reuses a revision, and
+        the row stays locked until the calling transaction ends.
+        """
+        forms = self.__class__.objects.filter(id=self.id)
+        if self.id is None or not forms.update(
+                revision=models.F("revision") + 1, **values):
+            return self.revision + 1
+        return forms.values_list("revision", flat=True)[0]
 
     def published(self, for_user=None):
         """
@@ -217,18 +291,29 @@ class AbstractField(models.Model):
     def __str__(self):
         return str(self.label)
 
+    @property
+    def choice_table(self):
+        """
+        The field's choices, parsed once per process for each value of
+        ``choices``.
+        """
+        return parse_choices(self.choices)
+
     def get_choices(self):
         """
         Iterator for the text of the available choices
         """
-        for choice in loads(self.choices):
-            yield choice['slug'], choice['text']
+        for choice in self.choice_table.choices:
+            yield choice
 
     def save(self, *args, **kwargs):
         if not self.slug:
             slug = slugify(self).replace('-', '_')
             self.slug = unique_slug(self.form.fields, "slug", slug)
-        return super(AbstractField, self).save(*args, **kwargs)
+        result = super(AbstractField, self).save(*args, **kwargs)
+        self.form.bump_revision()
+        invalidate_fields()
+        return result
 
     def is_a(self, *args):
         """
@@ -271,20 +356,163 @@ class AbstractFieldEntry(models.Model):
 #                                                 #
 ###################################################
 
+class FormEntryManager(models.Manager):
+    """
+    Loads the answers of entries and stores their scores in bulk.
+    """
+    def load_answers(self, entries):
+        """
+        Load the answers of each of the given entries for
+        ``FormEntry.load_answers``, querying the fields of each form
+        once and the field entries of all the entries at once.
+        """
+        forms = {}
+        form_fields = {}
+        for entry in entries:
+            if entry.form_id not in form_fields:
+                forms[entry.form_id] = entry.form
+                form_fields[entry.form_id] = list(entry.form.fields.all())
+            else:
+                entry.form = forms[entry.form_id]
+            entry._field_slugs = [f.slug for f in form_fields[entry.form_id]]
+            entry._answers = {}
+        fields_by_id = dict((f.id, f) for fields in form_fields.values()
+                            for f in fields)
+        entries_by_id = dict((entry.id, entry) for entry in entries)
+        # Loaded with a filter rather than entry.fields, which would set
+        # the entry on each field entry and make them query their field.
+        field_entries = FieldEntry.objects.filter(entry_id__in=entries_by_id)
+        for field_entry in field_entries:
+            field = fields_by_id.get(field_entry.field_id)
+            if field is None:
+                continue
+            field_entry._field = field
+            entry = entries_by_id[field_entry.entry_id]
+            field_entry.entry = entry
+            entry._answers[field.slug] = field_entry
+        return entries
+
+    def save_scores(self, entries):
+        """
+        Store the scores of the given entries whose forms have rules,
+        loading their forms and answers in bulk, and writing them with
+        a single query per score field. Entries whose rule raises an
+        error are logged and left without a score.
+        """
+        forms = Form.objects.in_bulk(set(entry.form_id for entry in entries))
+        for entry in entries:
+            entry.form = forms[entry.form_id]
+        entries = [entry for entry in entries if has_rule(entry.form.slug)]
+        if not entries:
+            return
+        self.load_answers(entries)
+        scores = {}
+        breakdowns = {}
+        for entry in entries:
+            try:
+                # Run in a savepoint, as in ``FormEntry.save_score``.
+                with atomic():
+                    entry.score, entry.score_breakdown = entry.compute_score()
+            except Exception:
+                logger.exception("Scoring rule for form %s failed on "
+                                 "entry %s" % (entry.form.slug, entry.id))
+                entry.score, entry.score_breakdown = None, ""
+            scores[entry.id] = entry.score
+            breakdowns[entry.id] = entry.score_breakdown
+        bulk_update(self.model, "score", scores)
+        bulk_update(self.model, "score_breakdown", breakdowns)
+
+
 class FormEntry(AbstractFormEntry):
     form = models.ForeignKey("Form", related_name="entries")
+    snapshot = models.ForeignKey("FormSnapshot", related_name="entries",
+                                 null=True, blank=True)
+    score = models.FloatField(_("Score"), null=True, blank=True,
+                              editable=False, db_index=True)
+    score_breakdown = models.TextField(_("Score breakdown"), blank=True,
+                                       editable=False)
+
+    objects = FormEntryManager()
+
+    class Meta(AbstractFormEntry.Meta):
+        # Django < 1.5 has no index_together, but the index is still
+        # created by the South migrations.
+        if django.VERSION >= (1, 5):
+            index_together = (("form", "entry_time"),)
 
     def keys(self):
+        if self._answers is not None:
+            return list(self._field_slugs)
         return list(self.form.fields.values_list('slug', flat=True))
 
+    # Field entries keyed by field slug, once loaded by load_answers().
+    _answers = None
+
+    def load_answers(self):
+        """
+        Load the entry's field entries into a mapping keyed by field
+        slug, each with its field and parsed choices attached, so that
+        reading answers with ``entry[slug]`` doesn't query the database.
+        """
+        FormEntry.objects.load_answers([self])
+        return self
+
     def scoring(self):
         # Run the rules associated with the form if there are any
         rule = import_rule(self.form.slug)
         if rule is not None:
+            if self._answers is None:
+                self.load_answers()
             return rule(self)
         return None
 
+    def compute_score(self):
+        """
+        Run the form's rule for the entry and return the values for its
+        ``score`` and ``score_breakdown`` fields. Rules can return a
+        number, or a dict of scores for each domain, whose total is the
+        score and which is stored as JSON in the breakdown.
+        """
+        result = self.scoring()
+        breakdown = ""
+        if isinstance(result, dict):
+            breakdown = dumps(result, cls=DjangoJSONEncoder)
+            result = sum(value for value in result.values()
+                         if isinstance(value, (int, float)))
+        try:
+            score = float(result)
+        except (TypeError, ValueError):
+            score = None
+        return score, breakdown
+
+    def save_score(self):
+        """
+        Store the entry's score if its form has a rule. Errors raised by
+        the rule are logged rather than failing the submission, with
+        the score left empty for ``rescore_entries`` to fill in.
+        """
+        if not has_rule(self.form.slug):
+            return
+        try:
+            # Run in a savepoint, so that a rule whose query fails
+            # doesn't break the transaction the entry is saved in.
+            with atomic():
+                self.score, self.score_breakdown = self.compute_score()
+        except Exception:
+            logger.exception("Scoring rule for form %s failed on entry %s"
+                             % (self.form.slug, self.id))
+            self.score, self.score_breakdown = None, ""
+        FormEntry.objects.filter(id=self.id).update(
+            score=self.score, score_breakdown=self.score_breakdown)
+
     def __getitem__(self, key):
+        if self._answers is not None:
+            try:
+                return self._answers[key]
+            except KeyError:
+                if key in self._field_slugs:
+                    raise FieldEntry.DoesNotExist
+                raise
         try:
             field = self.form.fields.get(slug=key)
             return self.fields.get(field_id=field.pk)
@@ -295,21 +523,28 @@ class FormEntry(AbstractFormEntry):
 class FieldEntry(AbstractFieldEntry):
     entry = models.ForeignKey("FormEntry", related_name="fields")
 
+    class Meta(AbstractFieldEntry.Meta):
+        if django.VERSION >= (1, 5):
+            index_together = (("entry", "field_id"),)
+
     def get_score(self):
         """
         Supposing that the user could choose one and only one answer
         for this field entry, returns the score corresponding to the
         choice he has made
         """
-        for choice in loads(self.choices):
-            if choice['slug'] == self.value:
-                return choice['score']
+        return self.choice_table.scores.get(self.value)
 
     def __getattribute__(self, name):
         try:
             return super(FieldEntry, self).__getattribute__(name)
         except AttributeError:
-            field = Field.objects.get(pk=self.field_id)
+            # Use the field attached by FormEntry.load_answers() or
+            # attach_fields() if any.
+            field = self.__dict__.get("_field")
+            if field is None:
+                field = field_cache.get(self.field_id)
+                self.__dict__["_field"] = field
             try:
                 return getattr(field, name)
             except AttributeError:
@@ -324,6 +559,20 @@ class Form(AbstractForm):
     pass
 
 
+m2m_changed.connect(invalidate_published_index, sender=Form.sites.through)
+
+
+def release_field_entry_blob(sender, instance, **kwargs):
+    """
+    Drop the deleted field entry's reference to its upload.
+    """
+    if is_blob(instance.value):
+        release_blob(instance.value)
+
+
+post_delete.connect(release_field_entry_blob, sender=FieldEntry)
+
+
 class Field(AbstractField):
     """
     Implements automated field ordering.
@@ -344,3 +593,234 @@ class Field(AbstractField):
         fields_after = self.form.fields.filter(order__gte=self.order)
         fields_after.update(order=models.F("order") - 1)
         super(Field, self).delete(*args, **kwargs)
+        self.form.bump_revision()
+        invalidate_fields()
+
+
+class FormSnapshotManager(models.Manager):
+    """
+    Freezes forms and looks up their most recent snapshot.
+    """
+    def take(self, form):
+        """
+        Store the form's settings and fields as they are at its current
+        revision, unless a snapshot of that revision already exists.
+        """
+        revision = form.__class__.objects.filter(id=form.id).values_list(
+            "revision", flat=True)[0]
+        try:
+            return self.get(form=form, revision=revision)
+        except self.model.DoesNotExist:
+            pass
+        values = lambda obj, exclude=(): dict(
+            (f.attname, getattr(obj, f.attname))
+            for f in obj._meta.fields if f.attname not in exclude)
+        data = {
+            "form": dict(values(form), revision=revision),
+            "sites": list(form.sites.values_list("id", flat=True)),
+            "fields": [values(field, exclude=("form_id",))
+                       for field in form.fields.all()],
+        }
+        return self.create(form=form, slug=form.slug, revision=revision,
+                           data=dumps(data, cls=DjangoJSONEncoder),
+                           created=now())
+
+    def current(self, **lookups):
+        """
+        Return the snapshot matching the given lookups taken at its
+        form's current revision, or None if there isn't one, such as
+        when the form or its fields have changed since the last
+        snapshot.
+        """
+        snapshots = self.filter(revision=models.F("form__revision"))
+        try:
+            return snapshots.filter(**lookups)[0]
+        except IndexError:
+            return None
+
+
+class FormSnapshot(models.Model):
+    """
+    The full schema of a form frozen at one of its revisions, so that
+    the form can be displayed from a single row.
+    """
+
+    form = models.ForeignKey("Form", related_name="snapshots")
+    slug = models.SlugField(max_length=100)
+    revision = models.PositiveIntegerField()
+    data = models.TextField()
+    created = models.DateTimeField()
+
+    objects = FormSnapshotManager()
+
+    class Meta:
+        verbose_name = _("Form snapshot")
+        verbose_name_plural = _("Form snapshots")
+        unique_together = ("form", "revision")
+
+    def published(self, for_user=None):
+        """
+        Mimics the queryset logic in ``FormManager.published`` for the
+        frozen form settings.
+        """
+        if for_user is not None and for_user.is_staff:
+            return True
+        form = self.get_form()
+        status = form.status == STATUS_PUBLISHED
+        publish_date = form.publish_date is None or form.publish_date <= now()
+        expiry_date = form.expiry_date is None or form.expiry_date >= now()
+        site = (not settings.USE_SITES or
+                Site.objects.get_current().id in form.snapshot_sites)
+        return status and publish_date and expiry_date and site
+
+    def get_form(self):
+        """
+        Return an unsaved ``Form`` instance built from the snapshot,
+        with its fields already loaded so that displaying it doesn't
+        query the database.
+        """
+        try:
+            return self._form
+        except AttributeError:
+            pass
+        data = loads(self.data)
+        to_python = lambda model, values: dict(
+            (f.attname, f.to_python(values[f.attname]))
+            for f in model._meta.fields if f.attname in values)
+        form = Form(**to_python(Form, data["form"]))
+        form.snapshot_id = self.id
+        form.snapshot_sites = data["sites"]
+        fields = Field.objects.filter(form=form)
+        fields._result_cache = [Field(form=form, **to_python(Field, values))
+                                for values in data["fields"]]
+        fields._prefetch_done = True
+        form._prefetched_objects_cache = {"fields": fields}
+        self._form = form
+        return form
+
+
+class ContextEncoder(DjangoJSONEncoder):
+    """
+    Encodes email contexts, storing values JSON has no type for, such
+    as uploaded files, as the text they'd be displayed as.
+    """
+    def default(self, o):
+        try:
+            return super(ContextEncoder, self).default(o)
+        except TypeError:
+            return str(o)
+
+
+class EmailJobManager(models.Manager):
+    """
+    Queues emails for form entries and looks up those due to be sent.
+    """
+    def queue(self, entry, template, subject, email_from, recipients,
+              context, attachments=None, headers=None):
+        """
+        Store an email to be sent later by the ``send_form_emails``
+        management command. ``attachments`` holds the names of files
+        saved in the upload storage.
+        """
+        context = dict(context)
+        request = context.pop("request", None)
+        if request is not None:
+            # The email templates only use the request for its host.
+            context["request"] = {"get_host": request.get_host()}
+        return self.create(entry=entry, template=template, subject=subject,
+                           email_from=email_from,
+                           recipients=",".join(recipients),
+                           context=dumps(context, cls=ContextEncoder),
+                           attachments=dumps(attachments or []),
+                           headers=dumps(headers or {}),
+                           next_attempt=now())
+
+    def due(self):
+        """
+        Emails that haven't been sent, are due for an attempt, and
+        haven't used up their attempts.
+        """
+        return self.filter(sent__isnull=True, next_attempt__lte=now(),
+                           attempts__lt=settings.EMAIL_MAX_ATTEMPTS)
+
+
+class EmailJob(models.Model):
+    """
+    An email for a form entry waiting in the outbox.
+    """
+
+    entry = models.ForeignKey("FormEntry", related_name="email_jobs")
+    template = models.CharField(max_length=100)
+    subject = models.CharField(max_length=200)
+    email_from = models.CharField(max_length=200)
+    recipients = models.TextField()
+    context = models.TextField()
+    attachments = models.TextField()
+    headers = models.TextField()
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    objects = EmailJobManager()
+
+    class Meta:
+        verbose_name = _("Email job")
+        verbose_name_plural = _("Email jobs")
+
+    def claim(self):
+        """
+        Push back the next attempt so that no other worker picks up
+        the email while it's being sent, returning False if another
+        worker already has.
+        """
+        next_attempt = now() + timedelta(seconds=settings.EMAIL_RETRY_DELAY)
+        claimed = EmailJob.objects.filter(id=self.id, attempts=self.attempts,
+                                          next_attempt=self.next_attempt,
+                                          sent__isnull=True)
+        if not claimed.update(next_attempt=next_attempt):
+            return False
+        self.next_attempt = next_attempt
+        return True
+
+    def send(self, connection=None):
+        """
+        Send the email over the given connection, recording the error
+        and scheduling a retry if it fails. The delay between attempts
+        doubles each time.
+        """
+        try:
+            attachments = [attachment(name)
+                           for name in loads(self.attachments)]
+            send_mail_template(self.subject, self.template, self.email_from,
+                               self.recipients.split(","),
+                               context=loads(self.context),
+                               attachments=attachments,
+                               headers=loads(self.headers) or None,
+                               connection=connection)
+        except Exception as e:
+            self.attempts += 1
+            self.last_error = "%s: %s" % (e.__class__.__name__, e)
+            delay = settings.EMAIL_RETRY_DELAY * 2 ** (self.attempts - 1)
+            self.next_attempt = now() + timedelta(seconds=delay)
+            self.save()
+            return False
+        self.attempts += 1
+        self.sent = now()
+        self.save()
+        return True
+
+
+class UploadBlob(models.Model):
+    """
+    The number of field entries referring to each upload stored once
+    per unique content when ``FORMS_BUILDER_CONTENT_ADDRESSED_UPLOADS``
+    is set.
+    """
+
+    sha1 = models.CharField(max_length=40, unique=True)
+    references = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Upload blob")
+        verbose_name_plural = _("Upload blobs")
@@ -0,0 +1,208 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple
+from hashlib import md5
+
+from django.core.cache import cache
+from django.template import Context, Template, TextNode, VariableNode
+
+from forms_builder.forms import fields
+from forms_builder.forms import settings
+
+
+class FieldPlan(namedtuple("FieldPlan", ("id", "slug", "field_type",
+                                         "default", "dynamic_default",
+                                         "args", "attrs"))):
+    """
+    Everything needed to build the form field for a ``Field`` instance,
+    with the choices already parsed and the widget attributes already
+    worked out. ``args`` and ``attrs`` are tuples of name/value pairs
+    so that the plan stays immutable once compiled. ``dynamic_default``
+    is True when the default value contains template code.
+    """
+    __slots__ = ()
+
+    def is_a(self, *args):
+        """
+        Helper that returns True if the field's type is given in any arg.
+        """
+        return self.field_type in args
+
+
+# ``pages`` is a tuple holding a tuple of field slugs for each page.
+FormPlan = namedtuple("FormPlan", ("form_id", "revision", "fields", "pages"))
+
+
+# Compiled plans and payloads for this process, keyed by their kind and
+# form ID. Each is stored with the revision of the form it was compiled
+# from, so a form that has since been edited never gets a stale one.
+_plans = {}
+
+# Compiled default value templates for this process, keyed by field ID.
+# Each holds the hash of the default it was compiled from, the template
+# and the names of the context variables it references.
+_default_templates = {}
+
+
+def compile_field(field):
+    """
+    Work out the form field class arguments and widget attributes for
+    the given ``Field`` instance.
+    """
+    field_class = fields.CLASSES[field.field_type]
+    args = {"label": field.label, "required": field.required,
+            "help_text": field.help_text}
+    arg_names = field_class.__init__.__code__.co_varnames
+    if "max_length" in arg_names:
+        args["max_length"] = settings.FIELD_MAX_LENGTH
+    if "choices" in arg_names:
+        choices = list(field.get_choices())
+        if (field.field_type == fields.SELECT and
+                field.default not in [c[0] for c in choices]):
+            choices.insert(0, ("", field.placeholder_text))
+        args["choices"] = tuple(choices)
+    # Add identifying CSS classes to the field.
+    attrs = {"class": field_class.__name__.lower()}
+    if field.required:
+        attrs["class"] += " required"
+        if (settings.USE_HTML5 and
+                field.field_type != fields.CHECKBOX_MULTIPLE):
+            attrs["required"] = ""
+    if field.placeholder_text and not field.default:
+        attrs["placeholder"] = field.placeholder_text
+    dynamic_default = "{{" in field.default or "{%" in field.default
+    return FieldPlan(field.id, field.slug, field.field_type, field.default,
+                     dynamic_default, tuple(args.items()),
+                     tuple(attrs.items()))
+
+
+def compile_form(form):
+    """
+    Compile the plan for each of the visible fields of the given form.
+    Fields are filtered here rather than in the database so that any
+    fields already loaded with the form are used.
+    """
+    visible = [f for f in form.fields.all() if f.visible]
+    compiled = tuple(compile_field(f) for f in visible)
+    return FormPlan(form.id, form.revision, compiled, compile_pages(visible))
+
+
+def compile_pages(form_fields):
+    """
+    Group the given fields into pages using each field's ``merge``
+    value. An integer N puts the next N fields on the same page as the
+    field, and a slug puts the field with that slug on its page.
+    """
+    merged = {}
+    for field in form_fields:
+        if field.merge and not field.merge.isdigit():
+            merged[field.merge] = field.slug
+    pages = []
+    page_of = {}
+    remaining = 0
+    for field in form_fields:
+        if field.slug in merged and merged[field.slug] in page_of:
+            page = page_of[merged[field.slug]]
+        elif remaining > 0:
+            page = len(pages) - 1
+            remaining -= 1
+        else:
+            pages.append([])
+            page = len(pages) - 1
+        if field.merge.isdigit():
+            remaining = max(remaining, int(field.merge))
+        pages[page].append(field.slug)
+        page_of[field.slug] = page
+    # Fields merged into one that comes after them get moved onto
+    # that field's page.
+    for slug, owner in merged.items():
+        if slug in page_of and page_of[slug] != page_of[owner]:
+            pages[page_of[slug]].remove(slug)
+            pages[page_of[owner]].append(slug)
+    return tuple(tuple(page) for page in pages if page)
+
+
+def get_compiled(form, kind, compile):
+    """
+    Return the value compiled by ``compile(form)`` for the given form's
+    current revision, looking in this process first, then in Django's
+    cache backend, and finally compiling it from the database.
+    """
+    try:
+        revision, compiled = _plans[(kind, form.id)]
+    except KeyError:
+        revision = None
+    if revision == form.revision:
+        return compiled
+    cache_key = "forms_builder.%s.%s.%s" % (kind, form.id, form.revision)
+    compiled = None
+    if settings.PLAN_CACHE_TIMEOUT:
+        compiled = cache.get(cache_key)
+    if compiled is None:
+        compiled = compile(form)
+        if settings.PLAN_CACHE_TIMEOUT:
+            cache.set(cache_key, compiled, settings.PLAN_CACHE_TIMEOUT)
+    _plans[(kind, form.id)] = (form.revision, compiled)
+    return compiled
+
+
+def get_form_plan(form):
+    """
+    Return the compiled plan for the given form.
+    """
+    return get_compiled(form, "plan", compile_form)
+
+
+def invalidate_form_plan(form_id):
+    """
+    Drop anything compiled by this process for the given form ID.
+    Other processes and the cache backend are taken care of by the
+    form's revision changing.
+    """
+    for key in list(_plans):
+        if key[1] == form_id:
+            del _plans[key]
+
+
+def template_variables(template):
+    """
+    Return the set of top-level context variable names referenced by
+    the given template, or None if it contains tags, since those can
+    read anything from the context.
+    """
+    names = set()
+    for node in template.nodelist:
+        if isinstance(node, VariableNode):
+            expression = node.filter_expression
+            variables = [expression.var]
+            for _, args in expression.filters:
+                variables.extend(arg for lookup, arg in args if lookup)
+            for var in variables:
+                if getattr(var, "lookups", None):
+                    names.add(var.lookups[0])
+        elif not isinstance(node, TextNode):
+            return None
+    return names
+
+
+def render_default(field, context):
+    """
+    Return the default value for the given field plan. Plain defaults
+    are returned as is, while templated defaults are compiled once and
+    rendered against only the context variables they reference.
+    """
+    if not field.dynamic_default:
+        return field.default
+    digest = md5(field.default.encode("utf-8")).hexdigest()
+    try:
+        compiled_digest, template, names = _default_templates[field.id]
+    except KeyError:
+        compiled_digest = None
+    if compiled_digest != digest:
+        template = Template(field.default)
+        names = template_variables(template)
+        _default_templates[field.id] = (digest, template, names)
+    if names is not None:
+        context = Context(dict((name, context[name])
+                               for name in names if name in context))
+    return template.render(context)
@@ -46,5 +46,94 @@ RULES_PATH = getattr(settings, "FORMS_BUILDER_RULES_PATH", None)
 
 ENABLE_VALIDATION = getattr(settings, "FORMS_BUILDER_ENABLE_VALIDATION", True)
 
+# Number of seconds compiled form plans are kept in Django's cache backend,
+# shared between processes. Set to 0 to only cache plans per process.
+PLAN_CACHE_TIMEOUT = getattr(settings, "FORMS_BUILDER_PLAN_CACHE_TIMEOUT",
+                             60 * 60 * 24)
+
+# Number of seconds the markup of unbound forms rendered with the
+# render_built_form template tag is cached for. Disabled by default.
+BUILT_FORM_CACHE_TIMEOUT = getattr(settings,
+                                   "FORMS_BUILDER_BUILT_FORM_CACHE_TIMEOUT", 0)
+
+# Boolean controlling whether forms are displayed from the snapshot taken
+# of them each time they're saved in the admin.
+USE_SNAPSHOTS = getattr(settings, "FORMS_BUILDER_USE_SNAPSHOTS", False)
+
+# Sequence of relations of the form model loaded along with it in the form
+# view, for use in custom templates.
+FORM_SELECT_RELATED = getattr(settings, "FORMS_BUILDER_FORM_SELECT_RELATED",
+                              ())
+
+# Boolean controlling whether each process keeps an index of published
+# forms, rather than checking each form's publishing settings in the
+# database. Requires a cache backend shared between processes.
+USE_PUBLISHED_INDEX = getattr(settings, "FORMS_BUILDER_USE_PUBLISHED_INDEX",
+                              False)
+
+# Number of threads used for work done in the background, such as sending
+# emails from the background form view, and the number of tasks that can
+# be queued for them before tasks are run in the calling thread instead.
+BACKGROUND_WORKERS = getattr(settings, "FORMS_BUILDER_BACKGROUND_WORKERS", 4)
+BACKGROUND_QUEUE_SIZE = getattr(settings,
+                                "FORMS_BUILDER_BACKGROUND_QUEUE_SIZE", 1000)
+
+# Boolean controlling whether the form view queues its emails in the
+# database, to be sent by the send_form_emails management command.
+QUEUE_EMAILS = getattr(settings, "FORMS_BUILDER_QUEUE_EMAILS", False)
+
+# Number of times sending a queued email is attempted, and the number of
+# seconds before the first retry, which doubles with each attempt.
+EMAIL_MAX_ATTEMPTS = getattr(settings, "FORMS_BUILDER_EMAIL_MAX_ATTEMPTS", 5)
+EMAIL_RETRY_DELAY = getattr(settings, "FORMS_BUILDER_EMAIL_RETRY_DELAY", 60)
+
+# Size in bytes above which uploaded files are linked to from the emails
+# sent for an entry rather than attached to them. Set to 0 to always
+# attach uploads.
+ATTACHMENT_MAX_SIZE = getattr(settings, "FORMS_BUILDER_ATTACHMENT_MAX_SIZE",
+                              10 * 1024 * 1024)
+
+# Boolean controlling whether uploads are stored once per unique content,
+# under the SHA1 hash of their content, rather than once per upload.
+CONTENT_ADDRESSED_UPLOADS = getattr(settings,
+                                    "FORMS_BUILDER_CONTENT_ADDRESSED_UPLOADS",
+                                    False)
+
+# Path of the SQLite database the buffered form view stores submissions
+# in, the number of them saved per transaction by the
+# flush_form_submissions management command, and the number of seconds
+# it waits before checking for new submissions.
+SUBMISSION_BUFFER_PATH = getattr(settings,
+                                 "FORMS_BUILDER_SUBMISSION_BUFFER_PATH", None)
+SUBMISSION_BATCH_SIZE = getattr(settings,
+                                "FORMS_BUILDER_SUBMISSION_BATCH_SIZE", 500)
+SUBMISSION_FLUSH_INTERVAL = getattr(settings,
+                                    "FORMS_BUILDER_SUBMISSION_FLUSH_INTERVAL",
+                                    1)
+
+# Number of fields kept in memory for reading field attributes from
+# field entries, and a boolean controlling whether they're shared by
+# every request in the process rather than kept per request. Sharing
+# them requires a cache backend shared between processes.
+FIELD_CACHE_SIZE = getattr(settings, "FORMS_BUILDER_FIELD_CACHE_SIZE", 1000)
+USE_PROCESS_FIELD_CACHE = getattr(settings,
+                                  "FORMS_BUILDER_USE_PROCESS_FIELD_CACHE",
+                                  False)
+
+# Number of entries shown per page in the admin, and the number of
+# seconds the count of a form's entries shown there is cached for.
+ENTRIES_PER_PAGE = getattr(settings, "FORMS_BUILDER_ENTRIES_PER_PAGE", 100)
+ENTRIES_COUNT_CACHE_TIMEOUT = getattr(
+    settings, "FORMS_BUILDER_ENTRIES_COUNT_CACHE_TIMEOUT", 60)
+
+# Boolean controlling whether the form view shows forms a page at a
+# time, as grouped by each field's ``merge`` value.
+USE_PAGES = getattr(settings, "FORMS_BUILDER_USE_PAGES", False)
+
+# Number of parsed field choices kept in memory per process, keyed by
+# the JSON they were parsed from. Once full they're all parsed again.
+CHOICE_TABLE_CACHE_SIZE = getattr(settings,
+                                  "FORMS_BUILDER_CHOICE_TABLE_CACHE_SIZE", 1000)
+
 # Django SITE_ID - need a default since no longer provided in settings.py.
 SITE_ID = getattr(settings, "SITE_ID", 1)
@@ -1,6 +1,111 @@
 from __future__ import unicode_literals
 
+from logging import getLogger
+from time import time
+
 from django.dispatch import Signal
+from django.dispatch.dispatcher import NONE_ID, WEAKREF_TYPES, _make_id
+
+from forms_builder.forms.tasks import background
+
+
+logger = getLogger("forms_builder")
+
+
+class FormSignal(Signal):
+    """
+    Signal whose receivers can be connected with ``background=True`` to
+    have them run in the background pool of threads, so that slow
+    receivers don't hold up the response. Errors raised by background
+    receivers are logged rather than raised, and the time taken by each
+    receiver is logged at debug level. Receivers connected without it
+    are run during ``send`` as usual.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FormSignal, self).__init__(*args, **kwargs)
+        self.background_receivers = set()
+
+    def lookup_key(self, receiver, sender, dispatch_uid):
+        """
+        Return the key ``Signal.connect`` stores the receiver under.
+        """
+        return (dispatch_uid or _make_id(receiver), _make_id(sender))
+
+    def connect(self, receiver, sender=None, weak=True, dispatch_uid=None,
+                background=False):
+        lookup_key = self.lookup_key(receiver, sender, dispatch_uid)
+        with self.lock:
+            connected = lookup_key in [key for key, _ in self.receivers]
+        super(FormSignal, self).connect(receiver, sender=sender, weak=weak,
+                                        dispatch_uid=dispatch_uid)
+        # Connecting an already connected receiver leaves it as it was.
+        if connected:
+            return
+        if background:
+            self.background_receivers.add(lookup_key)
+        else:
+            self.background_receivers.discard(lookup_key)
+
+    def disconnect(self, receiver=None, sender=None, weak=True,
+                   dispatch_uid=None):
+        disconnected = super(FormSignal, self).disconnect(
+            receiver=receiver, sender=sender, weak=weak,
+            dispatch_uid=dispatch_uid)
+        self.background_receivers.discard(
+            self.lookup_key(receiver, sender, dispatch_uid))
+        return disconnected
+
+    def live_receivers(self, sender):
+        """
+        Return pairs of the lookup key and receiver for each live
+        receiver of the given sender, as ``Signal._live_receivers``
+        returns the receivers.
+        """
+        senderkey = _make_id(sender)
+        receivers = []
+        with self.lock:
+            for lookup_key, receiver in self.receivers:
+                if lookup_key[1] in (NONE_ID, senderkey):
+                    receivers.append((lookup_key, receiver))
+        live = []
+        for lookup_key, receiver in receivers:
+            if isinstance(receiver, WEAKREF_TYPES):
+                receiver = receiver()
+                if receiver is None:
+                    continue
+            live.append((lookup_key, receiver))
+        return live
+
+    def send(self, sender, **named):
+        """
+        Send the signal, queueing background receivers and running the
+        others. Background receivers have None as their response.
+        """
+        responses = []
+        if not self.receivers:
+            return responses
+        for lookup_key, receiver in self.live_receivers(sender):
+            if lookup_key in self.background_receivers:
+                background.submit(self.call, receiver, sender, named)
+                response = None
+            else:
+                response = self.call(receiver, sender, named)
+            responses.append((receiver, response))
+        return responses
+
+    def call(self, receiver, sender, named):
+        start = time()
+        try:
+            return receiver(signal=self, sender=sender, **named)
+        finally:
+            logger.debug("Receiver %r took %.3fs" % (receiver, time() - start))
+
 
-form_invalid = Signal(providing_args=["form"])
-form_valid = Signal(providing_args=["form", "entry"])
+form_invalid = FormSignal(providing_args=["form"])
+form_valid = FormSignal(providing_args=["form", "entry"])
+# Sent by the flush_form_submissions command for each buffered
+# submission once its entry is committed, with the submission buffer
+# as the sender. Buffered submissions are never sent with form_valid,
+# since there's no request or form by then.
+buffered_form_valid = FormSignal(providing_args=["entry"])
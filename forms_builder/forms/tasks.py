@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+
+from logging import getLogger
+from threading import Lock, Thread
+try:
+    from queue import Full, Queue
+except ImportError:  # Python 2
+    from Queue import Full, Queue
+
+try:
+    from django.db import close_old_connections
+except ImportError:  # Django < 1.6
+    from django.db import close_connection as close_old_connections
+
+from forms_builder.forms import settings
+
+
+logger = getLogger("forms_builder")
+
+
+class BackgroundPool(object):
+    """
+    A bounded pool of threads for running work that shouldn't hold up
+    the response, such as sending emails. Threads are started on first
+    use. When the queue is full, work is run in the calling thread so
+    that memory stays bounded under load.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue = Queue(queue_size)
+        self.threads = []
+        self.lock = Lock()
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def work(self):
+        """
+        Run queued work, closing the thread's database connection
+        around each task as the start and end of a request would. Work
+        run inline by ``submit`` leaves the connection alone, since it
+        belongs to the calling request.
+        """
+        while True:
+            func, args, kwargs = self.queue.get()
+            close_old_connections()
+            try:
+                self.run(func, *args, **kwargs)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run the given function, logging rather than raising any error.
+        """
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Error in background task %r" % func)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue the given function to be run by one of the pool's
+        threads, or run it now if there are no threads to run it.
+        """
+        if self.workers <= 0:
+            return self.run(func, *args, **kwargs)
+        if len(self.threads) < self.workers:
+            self.start()
+        try:
+            self.queue.put_nowait((func, args, kwargs))
+        except Full:
+            self.run(func, *args, **kwargs)
+
+    def join(self):
+        """
+        Block until all queued work has been run.
+        """
+        self.queue.join()
+
+
+background = BackgroundPool(settings.BACKGROUND_WORKERS,
+                            settings.BACKGROUND_QUEUE_SIZE)
@@ -2,14 +2,24 @@ from __future__ import unicode_literals
 from future.builtins import str
 
 from django import template
+from django.core.cache import cache
+from django.template.defaulttags import CsrfTokenNode
 from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 
 from forms_builder.forms.forms import FormForForm
-from forms_builder.forms.models import Form
+from forms_builder.forms.models import Form, FormSnapshot
+from forms_builder.forms.settings import (BUILT_FORM_CACHE_TIMEOUT,
+                                          USE_SNAPSHOTS)
 
 
 register = template.Library()
 
+# Stands in for the CSRF token in cached form markup, so that the real
+# token for each request can be swapped in after the cache lookup.
+CSRF_TOKEN_PLACEHOLDER = "FORMS_BUILDER_CSRF_TOKEN"
+
 
 class BuiltFormNode(template.Node):
 
@@ -24,20 +34,59 @@ class BuiltFormNode(template.Node):
         files = getattr(request, "FILES", None)
         if self.name != "form":
             lookup_value = template.Variable(self.value).resolve(context)
-            try:
-                form = Form.objects.get(**{str(self.name): lookup_value})
-            except Form.DoesNotExist:
-                form = None
+            snapshot = None
+            if USE_SNAPSHOTS:
+                lookup = {"id": "form_id", "slug": "slug"}[self.name]
+                snapshot = FormSnapshot.objects.current(
+                    **{str(lookup): lookup_value})
+            if snapshot is not None:
+                form = snapshot.get_form()
+            else:
+                try:
+                    form = Form.objects.get(**{str(self.name): lookup_value})
+                except Form.DoesNotExist:
+                    form = None
         else:
             form = template.Variable(self.value).resolve(context)
         if not isinstance(form, Form) or not form.published(for_user=user):
             return ""
+        # Reuse the form built by the form view for this form, either
+        # bound or for one page of a paged form.
+        form_for_form = context.get("form_for_form")
+        reused = getattr(form_for_form, "form", None) is form
+        if BUILT_FORM_CACHE_TIMEOUT and not (post or files or reused):
+            return self.render_cached(form, context)
         t = get_template("forms/includes/built_form.html")
         context["form"] = form
-        form_args = (form, context, post or None, files or None)
-        context["form_for_form"] = FormForForm(*form_args)
+        if not reused:
+            form_args = (form, context, post or None, files or None)
+            context["form_for_form"] = FormForForm(*form_args)
         return t.render(context)
 
+    def render_cached(self, form, context):
+        """
+        Render the unbound form with a placeholder CSRF token, caching
+        the markup against the form's revision and the current language
+        unless a field's default value depends on the context.
+        """
+        cache_key = "forms_builder.built_form.%s.%s.%s" % (
+            form.id, form.revision, get_language())
+        html = cache.get(cache_key)
+        if html is None:
+            t = get_template("forms/includes/built_form.html")
+            context["form"] = form
+            form_for_form = FormForForm(form, context)
+            context["form_for_form"] = form_for_form
+            context.update({"csrf_token": CSRF_TOKEN_PLACEHOLDER})
+            html = t.render(context)
+            context.pop()
+            if not any(f.dynamic_default for f in form_for_form.form_fields):
+                cache.set(cache_key, html, BUILT_FORM_CACHE_TIMEOUT)
+        placeholder = CsrfTokenNode().render(
+            template.Context({"csrf_token": CSRF_TOKEN_PLACEHOLDER}))
+        return mark_safe(html.replace(placeholder,
+                                      CsrfTokenNode().render(context)))
+
 
 @register.tag
 def render_built_form(parser, token):
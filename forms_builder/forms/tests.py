@@ -1,25 +1,65 @@
 from __future__ import unicode_literals
 
+import sys
+from datetime import datetime
+from importlib import import_module
+from json import loads
+from os import devnull
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import current_thread
+from types import ModuleType
+
 from django.conf import settings
+from django.contrib import admin as django_admin
 from django.contrib.auth.models import User, AnonymousUser
 from django.contrib.sites.models import Site
-from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection
+try:
+    from django.db.transaction import atomic
+except ImportError:  # Django < 1.6
+    from django.db.transaction import commit_on_success as atomic
+from django.http import Http404, HttpResponseRedirect
 from django.template import Context, RequestContext, Template
+from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.http import http_date
 
-from forms_builder.forms.fields import NAMES, FILE
-from forms_builder.forms.forms import FormForForm
-from forms_builder.forms.models import (Form, Field,
+from forms_builder.forms.buffer import SubmissionBuffer
+from forms_builder.forms.fieldcache import attach_fields
+from forms_builder.forms.fields import (NAMES, CHECKBOX_MULTIPLE, DATE,
+                                        EMAIL, FILE, SELECT)
+from forms_builder.forms.forms import (EntriesForm, FormForForm,
+                                       PagedFormForForm)
+from forms_builder.forms.models import (EmailJob, Form, Field, FormEntry,
+                                        FieldEntry, FormSnapshot, UploadBlob,
                                         STATUS_DRAFT, STATUS_PUBLISHED)
+from forms_builder.forms import (admin, forms, plans, signals, tasks,
+                                 uploads, utils, views)
+from forms_builder.forms import settings as forms_settings
 from forms_builder.forms.settings import USE_SITES
-from forms_builder.forms.signals import form_invalid, form_valid
+from forms_builder.forms.signals import (buffered_form_valid,
+                                         form_invalid, form_valid)
+from forms_builder.forms.tasks import BackgroundPool, background
+from forms_builder.forms.utils import now
 
 
 class Tests(TestCase):
 
     def setUp(self):
         self._site = Site.objects.get_current()
+        # Form IDs are reused between tests, so drop compiled plans.
+        plans._plans.clear()
+        cache.clear()
 
     def test_form_fields(self):
         """
@@ -158,3 +198,1050 @@ class Tests(TestCase):
         self.assertEqual(response["location"], redirect_url)
         response = self.client.post(form_absolute_url, {'field': 'bar'})
         self.assertFalse(isinstance(response, HttpResponseRedirect))
+
+    def test_form_plan_cache(self):
+        """
+        Test that building a form from a cached plan doesn't query the
+        database, and that editing a field invalidates the plan.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="field", field_type=NAMES[0][0],
+                                   required=True, visible=True)
+        FormForForm(form, Context({}))
+        with self.assertNumQueries(0):
+            FormForForm(form, Context({}))
+        field.label = "changed"
+        field.save()
+        form = Form.objects.get(id=form.id)
+        form_for_form = FormForForm(form, Context({}))
+        self.assertEqual(form_for_form.fields[field.slug].label, "changed")
+
+    def test_stale_form_revision(self):
+        """
+        Test that saving a form loaded before one of its fields changed
+        still gives it a new revision.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        revisions = set([form.revision])
+        stale = Form.objects.get(id=form.id)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        revisions.add(Form.objects.get(id=form.id).revision)
+        stale.save()
+        revisions.add(stale.revision)
+        self.assertEqual(Form.objects.get(id=form.id).revision,
+                         stale.revision)
+        field.save()
+        revisions.add(Form.objects.get(id=form.id).revision)
+        self.assertEqual(len(revisions), 4)
+
+    def test_field_defaults(self):
+        """
+        Test that plain and templated field defaults are both rendered,
+        with templated defaults only seeing the variables they use.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        plain = form.fields.create(label="plain", field_type=NAMES[0][0],
+                                   default="plain {value")
+        dynamic = form.fields.create(label="dynamic", field_type=NAMES[0][0],
+                                     default="{{ name|default:other }}")
+        context = Context({"name": "", "other": "fallback"})
+        form_for_form = FormForForm(form, context)
+        self.assertEqual(form_for_form.initial[plain.slug], "plain {value")
+        self.assertEqual(form_for_form.initial[dynamic.slug], "fallback")
+
+    def test_tag_cache(self):
+        """
+        Test that the cached markup of the ``render_built_form`` tag
+        is reused with each request's own CSRF token.
+        """
+        from forms_builder.forms.templatetags import forms_builder_tags
+        form = Form.objects.create(title="Tags", status=STATUS_PUBLISHED)
+        form.fields.create(label="field", field_type=NAMES[0][0])
+        template = Template("{% load forms_builder_tags %}"
+                            "{% render_built_form id=form.id %}")
+        timeout = forms_builder_tags.BUILT_FORM_CACHE_TIMEOUT
+        forms_builder_tags.BUILT_FORM_CACHE_TIMEOUT = 60
+        try:
+            for token in ("first", "second"):
+                request = type(str(""), (), {"META": {"CSRF_COOKIE": token},
+                                             "user": AnonymousUser()})()
+                context = RequestContext(request, {"form": form})
+                html = template.render(context)
+                self.assertTrue("value='%s'" % token in html)
+                self.assertTrue("field" in html)
+            # Only the form itself is loaded once the markup is cached.
+            with self.assertNumQueries(1):
+                template.render(context)
+        finally:
+            forms_builder_tags.BUILT_FORM_CACHE_TIMEOUT = timeout
+
+    def test_form_snapshot(self):
+        """
+        Test that a form can be displayed from its snapshot with a
+        single query, and that snapshots of earlier revisions aren't
+        used once the form or its fields change.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        if USE_SITES:
+            form.sites.add(self._site)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        FormSnapshot.objects.take(form)
+        with self.assertNumQueries(1):
+            snapshot = FormSnapshot.objects.current(slug=form.slug)
+            self.assertTrue(snapshot.published())
+            form_for_form = FormForForm(snapshot.get_form(), Context({}))
+        self.assertEqual(form_for_form.fields[field.slug].label, "field")
+        field.label = "changed"
+        field.save()
+        self.assertEqual(FormSnapshot.objects.current(slug=form.slug), None)
+        FormSnapshot.objects.take(form)
+        snapshot = FormSnapshot.objects.current(slug=form.slug)
+        form_for_form = FormForForm(snapshot.get_form(), Context({}))
+        self.assertEqual(form_for_form.fields[field.slug].label, "changed")
+        # A form unpublished in code stops being served from its
+        # snapshot.
+        self.addCleanup(setattr, views, "USE_SNAPSHOTS", views.USE_SNAPSHOTS)
+        views.USE_SNAPSHOTS = True
+        user = AnonymousUser()
+        self.assertEqual(views.get_published_form(form.slug, user).id,
+                         form.id)
+        form.status = STATUS_DRAFT
+        form.save()
+        self.assertRaises(Http404, views.get_published_form, form.slug, user)
+
+    def test_published_with_fields(self):
+        """
+        Test that a published form and its fields are loaded with a
+        fixed number of queries, however many fields it has.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        if USE_SITES:
+            form.sites.add(self._site)
+        choices = '[{"slug": "a", "text": "A", "score": 1}]'
+        for (field, _) in NAMES:
+            form.fields.create(label=field, field_type=field, visible=True,
+                               choices=choices)
+        form.fields.create(label="hidden", field_type=NAMES[0][0],
+                           visible=False)
+        with self.assertNumQueries(2):
+            published = Form.objects.published_with_fields()
+            form_for_form = FormForForm(published.get(slug=form.slug),
+                                        Context({}))
+        self.assertEqual(len(form_for_form.fields), len(NAMES))
+
+    def test_published_index(self):
+        """
+        Test that the published form index answers without queries,
+        expires forms at their expiry date, reloads when its version
+        changes, and is invalidated again once a request that changed
+        forms inside a transaction has finished.
+        """
+        from datetime import timedelta
+        from django.core.signals import request_finished
+        from forms_builder.forms import index as index_module
+        index = index_module.PublishedFormIndex()
+        expiry_date = now() + timedelta(days=1)
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED,
+                                   expiry_date=expiry_date)
+        draft = Form.objects.create(title="Draft", status=STATUS_DRAFT)
+        if USE_SITES:
+            form.sites.add(self._site)
+            draft.sites.add(self._site)
+        self.assertEqual(index.get(form.slug), form.id)
+        self.addCleanup(setattr, index_module, "now", index_module.now)
+        with self.assertNumQueries(0):
+            self.assertEqual(index.get(form.slug), form.id)
+            self.assertEqual(index.get(draft.slug), None)
+            index_module.now = lambda: expiry_date + timedelta(seconds=1)
+            self.assertEqual(index.get(form.slug), None)
+        # Changes only show once the version changes.
+        Form.objects.filter(id=draft.id).update(status=STATUS_PUBLISHED)
+        self.assertEqual(index.get(draft.slug), None)
+        cache.set(index_module.VERSION_CACHE_KEY, "changed")
+        self.assertEqual(index.get(draft.slug), draft.id)
+        # Forms saved in a transaction invalidate the index again once
+        # the request finishes.
+        with atomic():
+            draft.status = STATUS_PUBLISHED
+            draft.save()
+        version = cache.get(index_module.VERSION_CACHE_KEY)
+        self.assertNotEqual(version, "changed")
+        request_finished.send(sender=None)
+        self.assertNotEqual(cache.get(index_module.VERSION_CACHE_KEY),
+                            version)
+        request_finished.send(sender=None)
+        self.assertEqual(index.get(draft.slug), draft.id)
+
+    def test_background_pool(self):
+        """
+        Test that work submitted to the background pool is run by its
+        threads, or inline when it has none.
+        """
+        threads = []
+        pool = BackgroundPool(workers=1, queue_size=1)
+        pool.submit(lambda: threads.append(current_thread()))
+        pool.join()
+        self.assertNotEqual(threads, [current_thread()])
+        pool = BackgroundPool(workers=0, queue_size=1)
+        pool.submit(lambda: threads.append(current_thread()))
+        self.assertEqual(threads[-1], current_thread())
+
+    def test_background_pool_inline(self):
+        """
+        Test that work run inline by the background pool leaves the
+        calling thread's transaction usable.
+        """
+        closed = []
+        self.addCleanup(setattr, tasks, "close_old_connections",
+                        tasks.close_old_connections)
+        tasks.close_old_connections = lambda: closed.append(current_thread())
+        pool = BackgroundPool(workers=0, queue_size=1)
+        with atomic():
+            User.objects.create_user("test", "", "test")
+            pool.submit(lambda: None)
+            self.assertEqual(closed, [])
+            self.assertFalse(getattr(connection, "needs_rollback", False))
+            self.assertTrue(User.objects.filter(username="test").exists())
+        self.assertTrue(User.objects.filter(username="test").exists())
+        # Worker threads still recycle their own connections.
+        pool = BackgroundPool(workers=1, queue_size=1)
+        pool.submit(lambda: None)
+        pool.join()
+        self.assertEqual(len(closed), 2)
+        self.assertNotEqual(closed[0], current_thread())
+
+    def test_background_form_detail(self):
+        """
+        Test that BackgroundFormDetail sends its emails from the
+        background pool's threads.
+        """
+        threads = []
+        def send_mail_template(*args, **kwargs):
+            threads.append(current_thread())
+            return send(*args, **kwargs)
+        send = views.send_mail_template
+        self.addCleanup(setattr, views, "send_mail_template", send)
+        views.send_mail_template = send_mail_template
+        self.addCleanup(setattr, views, "background", views.background)
+        views.background = BackgroundPool(workers=1, queue_size=1)
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED,
+                                   send_email=True)
+        field = form.fields.create(label="email", field_type=EMAIL)
+        form_for_form = FormForForm(form, Context({"user": user}),
+                                    {field.slug: "test@example.com"})
+        self.assertTrue(form_for_form.is_valid())
+        entry = form_for_form.save()
+        request = RequestFactory().post("/")
+        views.BackgroundFormDetail().send_emails(request, form_for_form,
+                                                 form, entry)
+        views.background.join()
+        self.assertEqual([m.to for m in mail.outbox], [["test@example.com"]])
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], current_thread())
+
+    def test_paged_form(self):
+        """
+        Test that a paged form only builds the fields on its page, and
+        saves the values from every page with the last one.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        first = form.fields.create(label="first", field_type=NAMES[0][0],
+                                   merge="1")
+        second = form.fields.create(label="second", field_type=NAMES[0][0])
+        third = form.fields.create(label="third", field_type=NAMES[0][0])
+        context = Context({"user": user})
+        storage = {}
+        pages = [{first.slug: "1", second.slug: "2"}, {third.slug: "3"}]
+        for page, data in enumerate(pages):
+            form_for_form = PagedFormForForm(form, context, data,
+                                             page=page, storage=storage)
+            self.assertEqual(set(form_for_form.fields), set(data))
+            self.assertTrue(form_for_form.is_valid())
+            entry = form_for_form.save()
+        values = entry.fields.values_list("field_id", "value")
+        self.assertEqual(dict(values), {first.id: "1", second.id: "2",
+                                        third.id: "3"})
+        self.assertEqual(storage, {})
+
+    def test_paged_form_incomplete(self):
+        """
+        Test that the last page of a paged form isn't accepted until the
+        required fields of the earlier pages have values, and that a
+        page the form doesn't have isn't found.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        first = form.fields.create(label="first", field_type=NAMES[0][0],
+                                   required=True)
+        second = form.fields.create(label="second", field_type=NAMES[0][0])
+        context = Context({"user": user})
+        storage = {}
+        form_for_form = PagedFormForForm(form, context, {second.slug: "2"},
+                                         page=1, storage=storage)
+        self.assertFalse(form_for_form.is_valid())
+        self.assertEqual(form_for_form.incomplete_page, 0)
+        self.assertFalse(FormEntry.objects.exists())
+        self.assertRaises(Http404, PagedFormForForm, form, context,
+                          page=2, storage=storage)
+        form_for_form = PagedFormForForm(form, context, {first.slug: "1"},
+                                         page=0, storage=storage)
+        self.assertTrue(form_for_form.is_valid())
+        form_for_form.save()
+        form_for_form = PagedFormForForm(form, context, {second.slug: "2"},
+                                         page=1, storage=storage)
+        self.assertTrue(form_for_form.is_valid())
+        self.assertEqual(form_for_form.incomplete_page, None)
+
+    def test_paged_form_view(self):
+        """
+        Test that the form view shows a page at a time when pages are
+        used, sending the user on to the next page as each is posted,
+        and back to any page left incomplete.
+        """
+        self.addCleanup(setattr, views, "USE_PAGES", views.USE_PAGES)
+        views.USE_PAGES = True
+        self.addCleanup(setattr, utils, "EXTRA_FIELDS", utils.EXTRA_FIELDS)
+        utils.EXTRA_FIELDS = {"Backend": {"strategy": "backend"}}
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED,
+                                   template="backend")
+        if USE_SITES:
+            form.sites.add(self._site)
+        first = form.fields.create(label="first", field_type=NAMES[0][0],
+                                   merge="1", required=True)
+        second = form.fields.create(label="second", field_type=NAMES[0][0])
+        third = form.fields.create(label="third", field_type=NAMES[0][0])
+
+        class PagedFormDetail(views.FormDetail):
+            def get_form(self, slug):
+                # The form's category isn't part of this app.
+                form = super(PagedFormDetail, self).get_form(slug)
+                form.risk = type(str("Risk"), (object,),
+                                 {"category": None})()
+                return form
+
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        def request(method, page, data=None):
+            url = "%s?page=%s" % (form.get_absolute_url(), page)
+            request = getattr(RequestFactory(), method)(url, data or {})
+            request.user = user
+            request.session = session
+            return PagedFormDetail.as_view()(request, slug=form.slug)
+        response = request("get", 2)
+        fields = response.context_data["form_for_form"].fields
+        self.assertEqual(list(fields), [third.slug])
+        response = request("post", 2, {third.slug: "3"})
+        self.assertEqual(response["Location"], form.get_absolute_url() +
+                         "?page=1")
+        response = request("post", 1, {first.slug: "1", second.slug: "2"})
+        self.assertEqual(response["Location"], form.get_absolute_url() +
+                         "?page=2")
+        self.assertFalse(FormEntry.objects.exists())
+        response = request("post", 2, {third.slug: "3"})
+        self.assertEqual(response["Location"],
+                         reverse("form_sent", kwargs={"slug": form.slug}))
+        values = FormEntry.objects.get().fields.values_list("field_id",
+                                                            "value")
+        self.assertEqual(dict(values),
+                         {first.id: "1", second.id: "2", third.id: "3"})
+        self.assertRaises(Http404, request, "get", 3)
+
+    def test_paged_form_uploads(self):
+        """
+        Test that uploads stored for a page are released when the page
+        is posted again with another file, and kept when it's posted
+        with the same one.
+        """
+        location = mkdtemp()
+        self.addCleanup(rmtree, location)
+        self.addCleanup(setattr, uploads, "fs", uploads.fs)
+        uploads.fs = FileSystemStorage(location=location)
+        self.addCleanup(setattr, forms_settings, "CONTENT_ADDRESSED_UPLOADS",
+                        forms_settings.CONTENT_ADDRESSED_UPLOADS)
+        forms_settings.CONTENT_ADDRESSED_UPLOADS = True
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="file", field_type=FILE)
+        form.fields.create(label="last", field_type=NAMES[0][0])
+        context = Context({"user": user})
+        storage = {}
+        values = []
+        for content in (b"first", b"first", b"second"):
+            upload = SimpleUploadedFile("a.txt", content)
+            form_for_form = PagedFormForForm(form, context, {},
+                                             {field.slug: upload},
+                                             page=0, storage=storage)
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+            values.append(storage[str(field.id)])
+        self.assertEqual(values[0], values[1])
+        self.assertFalse(uploads.fs.exists(uploads.storage_name(values[0])))
+        self.assertTrue(uploads.fs.exists(uploads.storage_name(values[2])))
+        self.assertEqual(UploadBlob.objects.get().references, 1)
+
+    def test_edit_entry(self):
+        """
+        Test that editing an entry only writes the values that changed,
+        and that emails for the entry list them.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        first = form.fields.create(label="first", field_type=NAMES[0][0])
+        second = form.fields.create(label="second", field_type=NAMES[0][0])
+        context = Context({"user": user})
+        data = {first.slug: "1", second.slug: "2"}
+        form_for_form = FormForForm(form, context, data)
+        self.assertTrue(form_for_form.is_valid())
+        entry = form_for_form.save()
+        self.assertEqual(form_for_form.changed_fields, set(data))
+        data[second.slug] = "3"
+        form_for_form = FormForForm(form, context, data, instance=entry)
+        self.assertTrue(form_for_form.is_valid())
+        # Entry save, field entries load and a single update, inside
+        # the savepoint used within the test's transaction.
+        with self.assertNumQueries(5):
+            form_for_form.save()
+        self.assertEqual(form_for_form.changed_fields, set([second.slug]))
+        values = entry.fields.values_list("field_id", "value")
+        self.assertEqual(dict(values), {first.id: "1", second.id: "3"})
+        # Queued emails list the changed fields in order.
+        self.addCleanup(setattr, views, "QUEUE_EMAILS", views.QUEUE_EMAILS)
+        views.QUEUE_EMAILS = True
+        form.email_copies = "copies@example.com"
+        request = RequestFactory().post("/")
+        views.FormDetail().send_emails(request, form_for_form, form, entry)
+        context = loads(EmailJob.objects.get().context)
+        self.assertEqual(context["changed_fields"], [second.slug])
+
+    def test_new_entry_queries(self):
+        """
+        Test that saving a new entry takes the same number of queries
+        however many fields the form has.
+        """
+        user = User.objects.create_user("test", "", "test")
+        context = Context({"user": user})
+        for num_fields in (1, 20):
+            form = Form.objects.create(title="Test %s" % num_fields,
+                                       status=STATUS_PUBLISHED)
+            data = {}
+            for i in range(num_fields):
+                field = form.fields.create(label="field %s" % i,
+                                           field_type=NAMES[0][0])
+                data[field.slug] = str(i)
+            form_for_form = FormForForm(form, context, data)
+            self.assertTrue(form_for_form.is_valid())
+            # Entry and field entry inserts, inside the savepoint used
+            # within the test's transaction.
+            with self.assertNumQueries(4):
+                entry = form_for_form.save()
+            self.assertEqual(entry.fields.count(), num_fields)
+            self.assertEqual(form_for_form.changed_fields, set(data))
+
+    def test_email_queue(self):
+        """
+        Test that queued emails are sent by the management command,
+        and that failed emails are retried later.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        form_for_form = FormForForm(form, Context({"user": user}),
+                                    {field.slug: "value"})
+        self.assertTrue(form_for_form.is_valid())
+        entry = form_for_form.save()
+        context = {"fields": [("field", "value")], "message": ""}
+        for address in ("a@example.com", "b@example.com"):
+            EmailJob.objects.queue(entry, "form_response", "Subject",
+                                   "from@example.com", [address], context)
+        self.assertEqual(len(mail.outbox), 0)
+        call_command("send_form_emails", stdout=open(devnull, "w"))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox),
+                         ["a@example.com", "b@example.com"])
+        self.assertTrue("field: value" in mail.outbox[0].body)
+        self.assertEqual(EmailJob.objects.due().count(), 0)
+        job = EmailJob.objects.queue(entry, "missing_template", "Subject",
+                                     "from@example.com", ["c@example.com"],
+                                     context)
+        self.assertFalse(job.send())
+        self.assertEqual(job.attempts, 1)
+        self.assertTrue(job.last_error)
+        self.assertTrue(job.next_attempt > now())
+        self.assertEqual(EmailJob.objects.due().count(), 0)
+
+    def test_attachments(self):
+        """
+        Test that uploads are attached to emails from where they're
+        stored, or linked to when they're too large, and only for the
+        copies of the emails.
+        """
+        location = mkdtemp()
+        self.addCleanup(rmtree, location)
+        storage = FileSystemStorage(location=location)
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED,
+                                   send_email=True)
+        field = form.fields.create(label="file", field_type=FILE)
+        email = form.fields.create(label="email", field_type=EMAIL)
+        upload = SimpleUploadedFile("test.txt", b"0123456789")
+        for module in (forms, views):
+            self.addCleanup(setattr, module, "fs", module.fs)
+            module.fs = storage
+        self.addCleanup(setattr, views, "ATTACHMENT_MAX_SIZE",
+                        views.ATTACHMENT_MAX_SIZE)
+        form_for_form = FormForForm(form, Context({"user": user}),
+                                    {email.slug: "test@example.com"},
+                                    {field.slug: upload})
+        self.assertTrue(form_for_form.is_valid())
+        entry = form_for_form.save()
+        request = RequestFactory().get("/")
+        view = views.FormDetail()
+        views.ATTACHMENT_MAX_SIZE = 10
+        attachments, links = view.get_attachments(request, form_for_form,
+                                                  entry)
+        self.assertEqual(attachments, [form_for_form.stored_files[field.slug]])
+        self.assertEqual(links, {})
+        views.ATTACHMENT_MAX_SIZE = 9
+        attachments, links = view.get_attachments(request, form_for_form,
+                                                  entry)
+        field_entry_id = entry.fields.values_list("id", flat=True)[0]
+        url = reverse("admin:form_file", args=(field_entry_id,))
+        self.assertEqual(attachments, [])
+        self.assertEqual(links, {field.slug: "http://testserver" + url})
+        # Uploads are only looked at for the copies, which are the only
+        # emails the admin links are given in.
+        get_attachments = view.get_attachments
+        calls = []
+        view.get_attachments = lambda *args: (calls.append(args) or
+                                              get_attachments(*args))
+        view.send_emails(request, form_for_form, form, entry)
+        self.assertEqual(calls, [])
+        self.assertFalse(url in mail.outbox[0].body)
+        form.email_copies = "copies@example.com"
+        view.send_emails(request, form_for_form, form, entry)
+        self.assertEqual(len(calls), 1)
+        bodies = dict((m.to[0], m.body) for m in mail.outbox[1:])
+        self.assertFalse(url in bodies["test@example.com"])
+        self.assertTrue(url in bodies["copies@example.com"])
+
+    def test_content_addressed_uploads(self):
+        """
+        Test that identical uploads are stored once, and deleted along
+        with the last entry referring to them, and that emails failing
+        to attach a deleted upload are retried.
+        """
+        location = mkdtemp()
+        self.addCleanup(rmtree, location)
+        self.addCleanup(setattr, uploads, "fs", uploads.fs)
+        uploads.fs = FileSystemStorage(location=location)
+        self.addCleanup(setattr, forms_settings, "CONTENT_ADDRESSED_UPLOADS",
+                        forms_settings.CONTENT_ADDRESSED_UPLOADS)
+        forms_settings.CONTENT_ADDRESSED_UPLOADS = True
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="file", field_type=FILE)
+        entries = []
+        for name in ("a.txt", "b.txt"):
+            upload = SimpleUploadedFile(name, b"content")
+            form_for_form = FormForForm(form, Context({"user": user}), {},
+                                        {field.slug: upload})
+            self.assertTrue(form_for_form.is_valid())
+            entries.append(form_for_form.save())
+        values = [e.fields.values_list("value", flat=True)[0]
+                  for e in entries]
+        self.assertEqual([v.split("/")[-1] for v in values],
+                         ["a.txt", "b.txt"])
+        name = uploads.storage_name(values[0])
+        self.assertEqual(name, uploads.storage_name(values[1]))
+        self.assertEqual(uploads.fs.open(name).read(), b"content")
+        self.assertEqual(UploadBlob.objects.get().references, 2)
+        # Re-uploading the same file when editing adds no reference.
+        upload = SimpleUploadedFile("b.txt", b"content")
+        form_for_form = FormForForm(form, Context({"user": user}), {},
+                                    {field.slug: upload}, instance=entries[1])
+        self.assertTrue(form_for_form.is_valid())
+        form_for_form.save()
+        self.assertEqual(UploadBlob.objects.get().references, 2)
+        entries[0].delete()
+        self.assertTrue(uploads.fs.exists(name))
+        entries[1].delete()
+        self.assertFalse(uploads.fs.exists(name))
+        self.assertEqual(UploadBlob.objects.count(), 0)
+        # A queued email whose attachment is gone counts as an attempt.
+        entry = FormEntry.objects.create(form=form, user=user,
+                                         entry_time=now())
+        job = EmailJob.objects.queue(entry, "form_response", "Subject",
+                                     "from@example.com", ["a@example.com"],
+                                     {}, attachments=[values[0]])
+        self.assertFalse(job.send())
+        self.assertEqual(job.attempts, 1)
+
+    def test_submission_buffer(self):
+        """
+        Test that buffered submissions are saved in a batch, and that
+        buffered_form_valid receivers get the saved entries.
+        """
+        location = mkdtemp()
+        self.addCleanup(rmtree, location)
+        submission_buffer = SubmissionBuffer(join(location, "buffer.db"))
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        for i in range(3):
+            form_for_form = FormForForm(form, Context({"user": user}),
+                                        {field.slug: str(i)})
+            self.assertTrue(form_for_form.is_valid())
+            entry = submission_buffer.append(form_for_form)
+            self.assertEqual(entry.pk, None)
+        self.assertEqual(submission_buffer.count(), 3)
+        self.assertEqual(form.entries.count(), 0)
+        saved = []
+        def receiver(sender=None, entry=None, **kwargs):
+            saved.append(entry.fields.values_list("value", flat=True)[0])
+        buffered_form_valid.connect(receiver)
+        self.addCleanup(buffered_form_valid.disconnect, receiver)
+        self.assertEqual(len(submission_buffer.flush(2)), 2)
+        self.assertEqual(len(submission_buffer.flush(2)), 1)
+        self.assertEqual(submission_buffer.flush(2), [])
+        self.assertEqual(saved, ["0", "1", "2"])
+        self.assertEqual(submission_buffer.count(), 0)
+        self.assertEqual(form.entries.count(), 3)
+
+    def test_failed_submissions(self):
+        """
+        Test that a buffered submission that can't be saved is moved out
+        of the buffer without holding up the rest of its batch.
+        """
+        location = mkdtemp()
+        self.addCleanup(rmtree, location)
+        submission_buffer = SubmissionBuffer(join(location, "buffer.db"))
+        user = User.objects.create_user("test", "", "test")
+        buffered_forms = []
+        for title in ("Kept", "Deleted"):
+            form = Form.objects.create(title=title, status=STATUS_PUBLISHED)
+            field = form.fields.create(label="field", field_type=NAMES[0][0])
+            form_for_form = FormForForm(form, Context({"user": user}),
+                                        {field.slug: title})
+            self.assertTrue(form_for_form.is_valid())
+            submission_buffer.append(form_for_form)
+            buffered_forms.append(form)
+        buffered_forms[1].delete()
+        entries = submission_buffer.flush(10)
+        self.assertEqual([entry.form_id for entry in entries],
+                         [buffered_forms[0].id])
+        self.assertEqual(submission_buffer.count(), 0)
+        failed = submission_buffer.failed()
+        self.assertEqual(len(failed), 1)
+        self.assertTrue("no longer exists" in failed[0][2])
+        self.assertEqual(submission_buffer.flush(10), [])
+
+    def test_flush_retries(self):
+        """
+        Test that flush_form_submissions retries after database errors,
+        waiting longer after each one in a row.
+        """
+        results = [DatabaseError, DatabaseError, [], StopIteration]
+        def flush(batch_size):
+            result = results.pop(0)
+            if isinstance(result, list):
+                return result
+            raise result
+        sleeps = []
+        def sleep(delay):
+            sleeps.append(delay)
+            if results[0] is StopIteration:
+                raise results.pop(0)
+        command = import_module("forms_builder.forms.management.commands."
+                                "flush_form_submissions")
+        self.addCleanup(setattr, command, "sleep", command.sleep)
+        command.sleep = sleep
+        self.addCleanup(setattr, command.submissions, "flush",
+                        command.submissions.flush)
+        command.submissions.flush = flush
+        self.assertRaises(StopIteration, call_command,
+                          "flush_form_submissions", interval=1,
+                          stdout=open(devnull, "w"))
+        self.assertEqual(sleeps, [2, 4, 1])
+
+    def test_background_receivers(self):
+        """
+        Test that receivers connected with background=True run in the
+        background pool, isolated from each other's errors, and only for
+        the connection they were given for.
+        """
+        calls = []
+        def failing(sender=None, **kwargs):
+            calls.append(("failing", current_thread()))
+            raise ValueError
+        def inline(sender=None, **kwargs):
+            calls.append(("inline", current_thread()))
+        form_valid.connect(failing, background=True)
+        form_valid.connect(inline)
+        self.addCleanup(form_valid.disconnect, failing)
+        self.addCleanup(form_valid.disconnect, inline)
+        responses = form_valid.send(sender=None, form=None, entry=None)
+        background.join()
+        self.assertEqual(len(responses), 2)
+        threads = dict(calls)
+        self.assertEqual(threads["inline"], current_thread())
+        self.assertNotEqual(threads["failing"], current_thread())
+        # The flag is kept per connection, so connecting the receiver
+        # again for another sender leaves it running in the background.
+        form_valid.connect(failing, sender=Form)
+        self.addCleanup(form_valid.disconnect, failing, sender=Form)
+        del calls[:]
+        form_valid.send(sender=None, form=None, entry=None)
+        background.join()
+        self.assertNotEqual(dict(calls)["failing"], current_thread())
+        del calls[:]
+        self.assertRaises(ValueError, form_valid.send, sender=Form,
+                          form=None, entry=None)
+
+    def test_background_receivers_inline(self):
+        """
+        Test that when the pool has no threads, background receivers
+        are run inline without closing the sender's connection, and
+        their errors don't break its transaction.
+        """
+        closed = []
+        self.addCleanup(setattr, tasks, "close_old_connections",
+                        tasks.close_old_connections)
+        tasks.close_old_connections = lambda: closed.append(current_thread())
+        self.addCleanup(setattr, signals, "background", signals.background)
+        signals.background = BackgroundPool(workers=0, queue_size=1)
+        calls = []
+        def receiver(sender=None, **kwargs):
+            calls.append(current_thread())
+            raise ValueError
+        form_valid.connect(receiver, background=True)
+        self.addCleanup(form_valid.disconnect, receiver)
+        with atomic():
+            User.objects.create_user("test", "", "test")
+            form_valid.send(sender=None, form=None, entry=None)
+            self.assertEqual(calls, [current_thread()])
+            self.assertEqual(closed, [])
+            self.assertTrue(User.objects.filter(username="test").exists())
+        self.assertTrue(User.objects.filter(username="test").exists())
+
+    def test_scoring_queries(self):
+        """
+        Test that scoring loads the entry's answers in two queries
+        however many answers the rule reads.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        choices = '[{"slug": "a", "text": "A", "score": 1}]'
+        data = {}
+        for i in range(10):
+            field = form.fields.create(label="field %s" % i, choices=choices,
+                                       field_type=SELECT)
+            data[field.slug] = "a"
+        form_for_form = FormForForm(form, Context({"user": user}), data)
+        self.assertTrue(form_for_form.is_valid())
+        entry_id = form_for_form.save().id
+        run = lambda entry: sum(entry[slug].get_score()
+                                for slug in entry.keys())
+        self.install_rule(form, run)
+        entry = FormEntry.objects.select_related("form").get(id=entry_id)
+        with self.assertNumQueries(2):
+            self.assertEqual(entry.scoring(), 10)
+        self.assertTrue(utils.import_rule(form.slug) is run)
+
+    def install_rule(self, form, run):
+        """
+        Make the given function the scoring rule for the form.
+        """
+        rules = ModuleType(str("fb_test_rules"))
+        rule = ModuleType(str("fb_test_rules.%s" % form.slug))
+        rule.run = run
+        for module in (rules, rule):
+            sys.modules[module.__name__] = module
+            self.addCleanup(sys.modules.pop, module.__name__, None)
+        self.addCleanup(setattr, utils, "RULES_PATH", utils.RULES_PATH)
+        utils.RULES_PATH = rules.__name__
+        utils._rules.clear()
+        self.addCleanup(utils._rules.clear)
+
+    def test_rescore_entries(self):
+        """
+        Test that the rescore_entries command stores the score of each
+        entry after the given ID.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        entry_ids = []
+        for i in range(5):
+            form_for_form = FormForForm(form, Context({"user": user}),
+                                        {field.slug: str(i)})
+            self.assertTrue(form_for_form.is_valid())
+            entry_ids.append(form_for_form.save().id)
+        self.install_rule(form, lambda entry: int(entry[field.slug].value))
+        call_command("rescore_entries", form.slug, chunk_size=2,
+                     processes=0, after=entry_ids[0],
+                     stdout=open(devnull, "w"))
+        scores = FormEntry.objects.order_by("id").values_list("score",
+                                                              flat=True)
+        self.assertEqual(list(scores), [None, 1, 2, 3, 4])
+
+    def test_stored_score(self):
+        """
+        Test that an entry's score and breakdown are stored when it's
+        saved, so that entries can be ordered and filtered by score in
+        the database.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        self.install_rule(form, lambda entry: {
+            "value": int(entry[field.slug].value), "bonus": 1})
+        for value in ("3", "1", "2"):
+            form_for_form = FormForForm(form, Context({"user": user}),
+                                        {field.slug: value})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        entries = FormEntry.objects.order_by("-score")
+        self.assertEqual([entry.score for entry in entries], [4, 3, 2])
+        self.assertEqual(loads(entries[0].score_breakdown),
+                         {"value": 3, "bonus": 1})
+        # The admin filter splits the range of the form's own scores
+        # into quarters that don't overlap.
+        other = Form.objects.create(title="Other", status=STATUS_PUBLISHED)
+        FormEntry.objects.create(form=other, user=user, entry_time=now(),
+                                 score=100)
+        model_admin = django_admin.site._registry[FormEntry]
+        request = RequestFactory().get("/", {"form__id__exact": form.id})
+        request.user = user
+        score_filter = admin.ScoreListFilter(request, {}, FormEntry,
+                                             model_admin)
+        lookups = score_filter.lookups(request, model_admin)
+        self.assertEqual([label for _, label in lookups],
+                         ["2 - 2.5", "2.5 - 3", "3 - 3.5", "3.5 - 4"])
+        scores = []
+        for value, _ in lookups:
+            score_filter.used_parameters = {"score": value}
+            filtered = score_filter.queryset(request,
+                                             FormEntry.objects.filter(
+                                                 form=form))
+            scores.extend(entry.score for entry in filtered)
+        self.assertEqual(sorted(scores), [2, 3, 4])
+
+    def test_failing_score(self):
+        """
+        Test that an entry is still saved when its form's rule raises an
+        error, with its score left empty and the rule's changes rolled
+        back.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        self.install_rule(form, lambda entry: entry["missing"])
+        form_for_form = FormForForm(form, Context({"user": user}),
+                                    {field.slug: "1"})
+        self.assertTrue(form_for_form.is_valid())
+        entry = form_for_form.save()
+        entry = FormEntry.objects.get(id=entry.id)
+        self.assertEqual(entry.score, None)
+        self.assertEqual(entry.fields.get().value, "1")
+        # Rules scored in bulk are each run in a savepoint, so that
+        # their failed queries are rolled back.
+        def run(entry):
+            User.objects.create_user("rule", "", "rule")
+            raise DatabaseError
+        self.install_rule(form, run)
+        FormEntry.objects.save_scores([entry])
+        self.assertEqual(FormEntry.objects.get(id=entry.id).score, None)
+        self.assertFalse(User.objects.filter(username="rule").exists())
+
+    def test_field_cache(self):
+        """
+        Test that fields read from field entries are loaded once, and
+        reloaded once they're changed.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="first", field_type=NAMES[0][0])
+        other = form.fields.create(label="second", field_type=NAMES[0][0])
+        form_for_form = FormForForm(form, Context({"user": user}),
+                                    {field.slug: "a", other.slug: "b"})
+        self.assertTrue(form_for_form.is_valid())
+        entry = form_for_form.save()
+        field_entries = FieldEntry.objects.filter(entry_id=entry.id)
+        with self.assertNumQueries(2):
+            labels = set(f.label for f in attach_fields(field_entries))
+        self.assertEqual(labels, set(["first", "second"]))
+        with self.assertNumQueries(1):
+            labels = set(f.label for f in field_entries.all())
+        self.assertEqual(labels, set(["first", "second"]))
+        field.label = "changed"
+        field.save()
+        labels = set(f.label for f in field_entries.all())
+        self.assertEqual(labels, set(["changed", "second"]))
+
+    def test_choice_tables(self):
+        """
+        Test that choices are parsed once for each value of a field's
+        choices, and that a column of answers is scored at once.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        choices = ('[{"slug": "a", "text": "A", "score": 1}, '
+                   '{"slug": "b", "text": "B", "score": 2}, '
+                   '{"slug": "c", "text": "C"}]')
+        field = form.fields.create(label="field", choices=choices,
+                                   field_type=SELECT)
+        table = field.choice_table
+        self.assertTrue(Field.objects.get(id=field.id).choice_table is table)
+        self.assertEqual(list(field.get_choices()),
+                         [("a", "A"), ("b", "B"), ("c", "C")])
+        self.assertEqual(table.score_column(["b", "a", "c", "d"]),
+                         [2, 1, None, None])
+        field.choices = '[{"slug": "a", "text": "A", "score": 3}]'
+        self.assertEqual(field.choice_table.score_column(["a"]), [3])
+        utils._choice_tables.pop(choices)
+        self.addCleanup(setattr, utils, "CHOICE_TABLE_CACHE_SIZE",
+                        utils.CHOICE_TABLE_CACHE_SIZE)
+        setattr(utils, "CHOICE_TABLE_CACHE_SIZE", 1)
+        utils.parse_choices(choices)
+        self.assertEqual(list(utils._choice_tables), [choices])
+
+    def test_entries_filters(self):
+        """
+        Test that entries are filtered by the filters checked in the
+        database along with those checked in Python.
+        """
+        user = User.objects.create_user("test", "", "test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        choices = '[{"slug": "x", "text": "X"}, {"slug": "y", "text": "Y"}]'
+        email = form.fields.create(label="email", field_type=NAMES[0][0])
+        select = form.fields.create(label="select", field_type=SELECT,
+                                    choices=choices)
+        multiple = form.fields.create(label="multiple", choices=choices,
+                                      field_type=CHECKBOX_MULTIPLE)
+        day = form.fields.create(label="day", field_type=DATE)
+        values = [("a@acme.com", "x", "x,y", "2014-01-05"),
+                  ("b@other.com", "x", "y", "2014-01-05"),
+                  ("c@acme.com", "y", "y", "2014-01-05"),
+                  ("d@acme.com", "x", "x", "2014-01-05"),
+                  ("e@acme.com", "x", "y", "2014-03-01")]
+        entry_ids = []
+        for row in values:
+            entry = FormEntry.objects.create(form=form, user=user,
+                                             entry_time=now())
+            entry_ids.append(entry.id)
+            for field, value in zip((email, select, multiple, day), row):
+                entry.fields.create(field_id=field.id, value=value)
+        data = {
+            "field_%s_filter" % email.id: forms.FILTER_CHOICE_CONTAINS,
+            "field_%s_contains" % email.id: "@ACME",
+            "field_%s_filter" % select.id: forms.FILTER_CHOICE_CONTAINS_ANY,
+            "field_%s_contains" % select.id: ["x"],
+            "field_%s_filter" % multiple.id:
+                forms.FILTER_CHOICE_CONTAINS_ANY,
+            "field_%s_contains" % multiple.id: ["y"],
+            "field_%s_filter" % day.id: forms.FILTER_CHOICE_BETWEEN,
+            "field_%s_from_year" % day.id: "2014",
+            "field_%s_from_month" % day.id: "1",
+            "field_%s_from_day" % day.id: "1",
+            "field_%s_to_year" % day.id: "2014",
+            "field_%s_to_month" % day.id: "1",
+            "field_%s_to_day" % day.id: "31",
+        }
+        entries_form = EntriesForm(form, RequestFactory().get("/"),
+                                   data=data)
+        self.assertTrue(entries_form.is_valid())
+        self.assertEqual([row[0] for row in entries_form.rows()],
+                         [entry_ids[0]])
+
+    def test_entries_pages(self):
+        """
+        Test that entries are shown in the admin a page at a time,
+        newest first, continuing from the last entry shown.
+        """
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        user = User.objects.get(username="test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        entry_ids = []
+        for i in range(5):
+            entry = FormEntry.objects.create(form=form, user=user,
+                                             entry_time=now())
+            entry.fields.create(field_id=field.id, value=str(i))
+            entry_ids.insert(0, entry.id)
+        self.addCleanup(setattr, admin, "ENTRIES_PER_PAGE",
+                        admin.ENTRIES_PER_PAGE)
+        admin.ENTRIES_PER_PAGE = 2
+        url = reverse("admin:form_entries_show", args=(form.id,))
+        pages = []
+        response = self.client.get(url)
+        while True:
+            pages.append([row[0] for row in response.context["rows"]])
+            self.assertEqual(response.context["entries_count"], 5)
+            next_before = response.context["next_before"]
+            if next_before is None:
+                break
+            response = self.client.post(url, {"before": next_before})
+        self.assertEqual(pages, [entry_ids[:2], entry_ids[2:4],
+                                 entry_ids[4:]])
+
+    def test_csv_export(self):
+        """
+        Test that the CSV export streams a row for each entry after the
+        column names, newest first.
+        """
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        user = User.objects.get(username="test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        for i in range(3):
+            entry = FormEntry.objects.create(form=form, user=user,
+                                             entry_time=now())
+            entry.fields.create(field_id=field.id, value="value %s" % i)
+        url = reverse("admin:form_entries_export", args=(form.id,))
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual([line.split(b",")[1] for line in lines],
+                         [b"field", b"value 2", b"value 1", b"value 0"])
+
+    def test_form_json_conditional_get(self):
+        """
+        Test that the JSON for a form is only sent again when neither
+        the ETag nor the modification date sent back still match.
+        """
+        self.addCleanup(setattr, utils, "EXTRA_FIELDS", utils.EXTRA_FIELDS)
+        utils.EXTRA_FIELDS = {"Frontend": {"strategy": "frontend"}}
+        User.objects.create_user("test", "", "test")
+        self.client.login(username="test", password="test")
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED,
+                                   template="frontend")
+        if USE_SITES:
+            form.sites.add(self._site)
+        url = reverse("form_detail_json", args=(form.slug,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        last_modified = response["Last-Modified"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"0-0"')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(0))
+        self.assertEqual(response.status_code, 200)
+        # Naive modification dates are in the default time zone.
+        updated = datetime(2020, 1, 1, 12, 0)
+        if settings.USE_TZ:
+            updated = timezone.make_aware(updated, timezone.utc)
+        Form.objects.filter(id=form.id).update(updated=updated)
+        with override_settings(TIME_ZONE="America/New_York"):
+            response = self.client.get(url)
+        expected = "Wed, 01 Jan 2020 %s:00:00 GMT" % (
+            "12" if settings.USE_TZ else "17")
+        self.assertEqual(response["Last-Modified"], expected)
@@ -0,0 +1,148 @@
+from __future__ import unicode_literals
+
+from hashlib import sha1
+from os import makedirs, remove, rename
+from os.path import basename, dirname, exists, join
+from uuid import uuid4
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError
+from django.db.models import F
+try:
+    from django.db.transaction import atomic
+except ImportError:  # Django < 1.6
+    from django.db.transaction import commit_on_success as atomic
+
+from forms_builder.forms import settings
+
+
+fs = FileSystemStorage(location=settings.UPLOAD_ROOT)
+
+# Directory under the upload storage that content addressed uploads are
+# stored in, each under a path made from the SHA1 hash of its content.
+BLOBS_DIR = "forms/blobs"
+
+
+def is_blob(value):
+    """
+    Return True if the given field entry value is a content addressed
+    upload.
+    """
+    return bool(value) and value.startswith(BLOBS_DIR + "/")
+
+
+def storage_name(value):
+    """
+    Return the name in the upload storage of the file for the given
+    field entry value. Content addressed uploads are stored as
+    ``<hash path>/<original file name>`` in the field entry, with the
+    file itself stored at the hash path.
+    """
+    if is_blob(value):
+        return dirname(value)
+    return value
+
+
+def attachment(value):
+    """
+    Return the given upload in a form ``send_mail_template`` can attach,
+    reading content addressed uploads so that they're attached with
+    their original file name.
+    """
+    if not is_blob(value):
+        return fs.path(value)
+    with fs.open(storage_name(value)) as f:
+        return (basename(value), f.read())
+
+
+def release_upload(value):
+    """
+    Remove the upload stored for the given field entry value, or the
+    reference to it when it's content addressed.
+    """
+    if is_blob(value):
+        release_blob(value)
+    else:
+        fs.delete(value)
+
+
+def locked_blob(digest):
+    """
+    Return the ``UploadBlob`` for the given hash, created with no
+    references if it doesn't exist, locking its row until the current
+    transaction ends so that its file can be checked and created or
+    deleted without racing other processes.
+    """
+    from forms_builder.forms.models import UploadBlob
+    blobs = UploadBlob.objects.select_for_update()
+    try:
+        return blobs.get(sha1=digest)
+    except UploadBlob.DoesNotExist:
+        try:
+            with atomic():
+                UploadBlob.objects.create(sha1=digest, references=0)
+        except IntegrityError:
+            pass  # Created by another process.
+        return blobs.get(sha1=digest)
+
+
+def store_blob(upload, replacing=None):
+    """
+    Store the given upload once per unique content, hashing it while
+    it's written to a temporary file in chunks, and return the value
+    for its field entry. Each upload stored adds a reference to the
+    blob, removed when its field entry is deleted, unless it's the
+    same as the field entry value it's ``replacing``, which already
+    refers to the blob.
+    """
+    from forms_builder.forms.models import UploadBlob
+    temp_dir = fs.path(join(BLOBS_DIR, "tmp"))
+    if not exists(temp_dir):
+        try:
+            makedirs(temp_dir)
+        except OSError:
+            pass  # Created by another process.
+    temp_path = join(temp_dir, uuid4().hex)
+    digest = sha1()
+    with open(temp_path, "wb") as f:
+        for chunk in upload.chunks():
+            digest.update(chunk)
+            f.write(chunk)
+    digest = digest.hexdigest()
+    name = join(BLOBS_DIR, digest[:2], digest[2:4], digest)
+    value = join(name, basename(upload.name))
+    if value == replacing:
+        remove(temp_path)
+        return value
+    path = fs.path(name)
+    with atomic():
+        blob = locked_blob(digest)
+        if exists(path):
+            remove(temp_path)
+        else:
+            if not exists(dirname(path)):
+                try:
+                    makedirs(dirname(path))
+                except OSError:
+                    pass
+            rename(temp_path, path)
+        blobs = UploadBlob.objects.filter(id=blob.id)
+        blobs.update(references=F("references") + 1)
+    return value
+
+
+def release_blob(value):
+    """
+    Remove a reference to the content addressed upload for the given
+    field entry value, deleting the file once nothing refers to it.
+    """
+    from forms_builder.forms.models import UploadBlob
+    name = storage_name(value)
+    with atomic():
+        blob = locked_blob(basename(name))
+        if blob.references > 1:
+            blobs = UploadBlob.objects.filter(id=blob.id)
+            blobs.update(references=F("references") - 1)
+        else:
+            blob.delete()
+            fs.delete(name)
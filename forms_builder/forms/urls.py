@@ -5,6 +5,23 @@ from django.conf.urls import patterns, url
 
 urlpatterns = patterns("forms_builder.forms.views",
     url(r"(?P<slug>.*)/sent/$", "form_sent", name="form_sent"),
+    url(r"(?P<slug>.*)/json/$", "form_detail_json", name="form_detail_json"),
     url(r"(?P<slug>.*)/$", "form_detail", name="form_detail"),
-    url(r"(?P<slug>.*)/json/$", "form_detail", name="form_detail_json"),
+)
+
+# Alternative to the above that sends emails in the background, included
+# with ``include(forms_builder.forms.urls.background_urlpatterns)``.
+background_urlpatterns = patterns("forms_builder.forms.views",
+    url(r"(?P<slug>.*)/sent/$", "form_sent", name="form_sent"),
+    url(r"(?P<slug>.*)/json/$", "form_detail_json", name="form_detail_json"),
+    url(r"(?P<slug>.*)/$", "background_form_detail", name="form_detail"),
+)
+
+# Alternative to the above that buffers submissions to be saved in batches
+# by the flush_form_submissions management command, included with
+# ``include(forms_builder.forms.urls.buffered_urlpatterns)``.
+buffered_urlpatterns = patterns("forms_builder.forms.views",
+    url(r"(?P<slug>.*)/sent/$", "form_sent", name="form_sent"),
+    url(r"(?P<slug>.*)/json/$", "form_detail_json", name="form_detail_json"),
+    url(r"(?P<slug>.*)/$", "buffered_form_detail", name="form_detail"),
 )
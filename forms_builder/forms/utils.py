@@ -7,8 +7,10 @@ try:
 except ImportError:  # Django <= 1.8
     from django.utils.importlib import import_module
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router
 from unidecode import unidecode
-from settings import EXTRA_FIELDS, RULES_PATH
+from settings import CHOICE_TABLE_CACHE_SIZE, EXTRA_FIELDS, RULES_PATH
+from collections import namedtuple
 from json import loads
 
 
@@ -53,6 +55,37 @@ def split_choices(choices_string):
     return [x.strip() for x in choices_string.split(",") if x.strip()]
 
 
+def bulk_update(model, field_name, values, batch_size=300):
+    """
+    Given a dict mapping primary keys of the model to values, update
+    the field with the given name for each row to its value, using a
+    single ``UPDATE ... CASE`` query per batch.
+    """
+    values = list(values.items())
+    if not values:
+        return
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    field = model._meta.get_field(field_name)
+    column = qn(field.column)
+    pk = qn(model._meta.pk.column)
+    case = "CASE %s %s END"
+    if connection.vendor == "postgresql":
+        # PostgreSQL types a CASE of only NULLs as text, which can't be
+        # assigned to other column types.
+        case = "CAST(%s AS %s)" % (case, field.db_type(connection))
+    cursor = connection.cursor()
+    for i in range(0, len(values), batch_size):
+        batch = values[i:i + batch_size]
+        sql = ("UPDATE %s SET %s = " + case + " WHERE %s IN (%s)") % (
+            table, column, pk, " ".join(["WHEN %s THEN %s"] * len(batch)),
+            pk, ", ".join(["%s"] * len(batch)))
+        params = [param for pair in batch for param in pair]
+        params.extend([key for key, value in batch])
+        cursor.execute(sql, params)
+
+
 def html5_field(name, base):
     """
     Takes a Django form field class and returns a subclass of
@@ -70,19 +103,79 @@ def import_attr(path):
     return getattr(import_module(module_path), attr_name)
 
 
+# Rule functions for this process keyed by form slug, holding None for
+# forms without a rule so that their failed import isn't repeated.
+_rules = {}
+
+
 def import_rule(slug):
     if RULES_PATH is None:
         raise ImproperlyConfigured(
             "You need to set the FORMS_BUILDER_RULES_PATH setting")
+    try:
+        return _rules[slug]
+    except KeyError:
+        pass
     module_path = ".".join([RULES_PATH, slug])
 
     try:
-        return getattr(import_module(module_path), 'run')
+        rule = getattr(import_module(module_path), 'run')
     except ImportError:
-        return None
+        rule = None
     except AttributeError:
         raise ImproperlyConfigured(
             "You need to create a run() function in file %s.py" % module_path)
+    _rules[slug] = rule
+    return rule
+
+
+def has_rule(slug):
+    """
+    Return True if a rule is set up for the form with the given slug.
+    """
+    return RULES_PATH is not None and import_rule(slug) is not None
+
+
+class ChoiceTable(namedtuple("ChoiceTable", ("choices", "texts", "scores"))):
+    """
+    A field's choices parsed from its JSON. ``choices`` is a tuple of
+    slug/text pairs in their order, while ``texts`` and ``scores`` are
+    dicts by slug, with ``scores`` only holding choices with a score.
+    Tables are shared, so they must not be changed.
+    """
+    __slots__ = ()
+
+    def score_column(self, values):
+        """
+        Return the score of each of the given chosen slugs, or None for
+        those without one.
+        """
+        scores = self.scores
+        return [scores.get(value) for value in values]
+
+
+# Parsed choice tables for this process keyed by the JSON they were
+# parsed from, so a field whose choices change gets a new table.
+_choice_tables = {}
+
+
+def parse_choices(choices):
+    """
+    Return the ``ChoiceTable`` for the given choices JSON.
+    """
+    try:
+        return _choice_tables[choices]
+    except KeyError:
+        pass
+    parsed = loads(choices) if choices else []
+    table = ChoiceTable(tuple((c["slug"], c["text"]) for c in parsed),
+                        dict((c["slug"], c["text"]) for c in parsed),
+                        dict((c["slug"], c["score"]) for c in parsed
+                             if "score" in c))
+    if len(_choice_tables) >= CHOICE_TABLE_CACHE_SIZE:
+        _choice_tables.clear()
+    _choice_tables[choices] = table
+    return table
 
 
 def get_templates_choices():
@@ -2,24 +2,36 @@
 from __future__ import unicode_literals
 
 import json
+from calendar import timegm
 
 from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ImproperlyConfigured
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404, redirect, render_to_response
-from django.template import RequestContext
-from django.utils.http import urlquote
+from django.template import Context, RequestContext
+from django.utils.http import (http_date, parse_etags, quote_etag,
+                               parse_http_date_safe, urlquote)
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.contrib.auth.decorators import login_required
 from django.views.generic.base import TemplateView
 from email_extras.utils import send_mail_template
 
-from forms_builder.forms.forms import FormForForm
-from forms_builder.forms.models import Form
-from forms_builder.forms.settings import EMAIL_FAIL_SILENTLY
+from forms_builder.forms.buffer import submissions
+from forms_builder.forms.forms import FormForForm, PagedFormForForm
+from forms_builder.forms.index import published_forms
+from forms_builder.forms.models import (EmailJob, FieldEntry, Form,
+                                        FormSnapshot)
+from forms_builder.forms.plans import get_compiled
+from forms_builder.forms.settings import (ATTACHMENT_MAX_SIZE,
+                                          EMAIL_FAIL_SILENTLY, QUEUE_EMAILS,
+                                          USE_PAGES, USE_PUBLISHED_INDEX,
+                                          USE_SNAPSHOTS)
 from forms_builder.forms.signals import form_invalid, form_valid
+from forms_builder.forms.tasks import background
+from forms_builder.forms.uploads import attachment, fs, storage_name
 from forms_builder.forms.utils import split_choices, get_form_conf_for
 from fields import WIDGETS
 from json import dumps, loads
@@ -50,18 +62,60 @@ def create_json(form, conf):
     return json
 
 
+def compile_json(form):
+    """
+    Serialize the JSON for the given form as compactly as possible.
+    """
+    conf = get_form_conf_for(form.template)
+    data = dumps(create_json(form, conf), ensure_ascii=False,
+                 separators=(",", ":"))
+    return data.encode("utf-8")
+
+
+def get_form_json(form):
+    """
+    Return the serialized JSON for the given form's current revision.
+    """
+    return get_compiled(form, "json", compile_json)
+
+
+def get_published_form(slug, for_user):
+    """
+    Return the published form for the given slug, built from its
+    snapshot when snapshots are used and one exists for the form's
+    current revision.
+    """
+    if USE_PUBLISHED_INDEX:
+        form_id = published_forms.get(slug, for_user=for_user)
+        if form_id is None:
+            raise Http404
+        lookup = {"form_id": form_id}
+        queryset = Form.objects.with_fields().filter(id=form_id)
+    else:
+        lookup = {"slug": slug}
+        queryset = Form.objects.published_with_fields(for_user=for_user)
+    if USE_SNAPSHOTS:
+        snapshot = FormSnapshot.objects.current(**lookup)
+        if snapshot is not None:
+            if not snapshot.published(for_user=for_user):
+                raise Http404
+            return snapshot.get_form()
+    return get_object_or_404(queryset, slug=slug)
+
+
 class FormDetail(TemplateView):
 
     # template_name = "forms/form_detail.html"
 
+    form = None
+
     def __init__(self, **kwargs):
         super(FormDetail, self).__init__(**kwargs)
         # self.published = Form.objects.published(for_user=self.request.user)
         # print self.published
 
     def get_form(self, slug):
-        published = Form.objects.published(for_user=self.request.user)
-        return get_object_or_404(published, slug=slug)
+        return get_published_form(slug, self.request.user)
 
     def get_template_names(self):
         if self.form.template:
@@ -70,8 +124,10 @@ class FormDetail(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(FormDetail, self).get_context_data(**kwargs)
-        self.form = self.get_form(kwargs["slug"])
-        self.conf = get_form_conf_for(self.form.template)
+        # Only load the form once per request.
+        if self.form is None:
+            self.form = self.get_form(kwargs["slug"])
+            self.conf = get_form_conf_for(self.form.template)
         context['category'] = self.form.risk.category
         context['title'] = self.form.title
         # If forms are generated using HTML widgets they need the form
@@ -79,7 +135,7 @@ class FormDetail(TemplateView):
             context["form"] = self.form
         # If forms are generated in Javascript, they need the JSON to create them
         elif self.conf['strategy'] == "frontend":
-            context["form"] = mark_safe(dumps(create_json(self.form, self.conf), ensure_ascii=False, indent=4))
+            context["form"] = mark_safe(get_form_json(self.form).decode("utf-8"))
         else:
             raise ImproperlyConfigured("The 'strategy' key in forms configuration must "
                                        "be either 'backend' or 'frontend'")
@@ -92,25 +148,50 @@ class FormDetail(TemplateView):
             path = urlquote(request.get_full_path())
             bits = (settings.LOGIN_URL, REDIRECT_FIELD_NAME, path)
             return redirect("%s?%s=%s" % bits)
+        if USE_PAGES and self.conf["strategy"] == "backend":
+            context["form_for_form"] = self.get_form_for_form(request)
         return self.render_to_response(context)
 
+    def get_form_for_form(self, request, *args, **kwargs):
+        """
+        Build the ``FormForForm`` for the request, or when
+        ``FORMS_BUILDER_USE_PAGES`` is set, the ``PagedFormForForm``
+        for the page given in the query string.
+        """
+        form_context = Context({"request": request, "user": request.user})
+        if not USE_PAGES:
+            return FormForForm(self.form, form_context, *args)
+        if "page" not in kwargs:
+            try:
+                kwargs["page"] = int(request.GET.get("page", 1)) - 1
+            except ValueError:
+                raise Http404
+        return PagedFormForForm(self.form, form_context, *args, **kwargs)
+
+    def page_url(self, page):
+        return "%s?page=%s" % (self.form.get_absolute_url(), page + 1)
+
     def post(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
-        form_for_form = FormForForm(self.form, RequestContext(request),
-                                    request.POST or None,
-                                    request.FILES or None)
+        form_for_form = self.get_form_for_form(request, request.POST or None,
+                                               request.FILES or None)
+        paged = isinstance(form_for_form, PagedFormForForm)
         if not form_for_form.is_valid():
+            # The last page is only accepted once the earlier pages
+            # have been completed, so send the user back to them.
+            if (paged and form_for_form.incomplete_page is not None and
+                    not self.request.is_ajax()):
+                return redirect(self.page_url(form_for_form.incomplete_page))
             form_invalid.send(sender=request, form=form_for_form)
+        elif paged and not form_for_form.is_last_page():
+            form_for_form.save()
+            next_page = form_for_form.page + 1
+            if not self.request.is_ajax():
+                return redirect(self.page_url(next_page))
+            form_for_form = self.get_form_for_form(
+                request, page=next_page, storage=form_for_form.storage)
         else:
-            # Attachments read must occur before model save,
-            # or seek() will fail on large uploads.
-            attachments = []
-            for f in form_for_form.files.values():
-                f.seek(0)
-                attachments.append((f.name, f.read()))
-            entry = form_for_form.save()
-            form_valid.send(sender=request, form=form_for_form, entry=entry)
-            self.send_emails(request, form_for_form, self.form, entry, attachments)
+            self.save_entry(request, form_for_form)
             if not self.request.is_ajax():
                 return redirect(
                     self.form.redirect_url or reverse(
@@ -118,6 +199,15 @@ class FormDetail(TemplateView):
         context.update({"form_for_form": form_for_form})
         return self.render_to_response(context)
 
+    def save_entry(self, request, form_for_form):
+        """
+        Save the entry for a valid submission, and send the form_valid
+        signal and emails for it.
+        """
+        entry = form_for_form.save()
+        form_valid.send(sender=request, form=form_for_form, entry=entry)
+        self.send_emails(request, form_for_form, self.form, entry)
+
     def render_to_response(self, context, **kwargs):
         if self.request.is_ajax() and self.conf['strategy'] == 'backend':
             json_context = json.dumps({
@@ -128,46 +218,181 @@ class FormDetail(TemplateView):
             return HttpResponse(json_context, content_type="application/json")
         return super(FormDetail, self).render_to_response(context, **kwargs)
 
-    def send_emails(self, request, form_for_form, form, entry, attachments):
+    def get_attachments(self, request, form_for_form, entry):
+        """
+        Return the names of the stored uploads to attach to emails, and
+        a dict mapping field slugs to a link for each upload larger than
+        ``FORMS_BUILDER_ATTACHMENT_MAX_SIZE``, which is linked to from
+        the emails instead.
+        """
+        attachments = []
+        linked = []
+        for slug, name in form_for_form.stored_files.items():
+            size = fs.size(storage_name(name))
+            # Links need the ID of the saved field entry.
+            if (ATTACHMENT_MAX_SIZE and size > ATTACHMENT_MAX_SIZE and
+                    entry.pk is not None):
+                linked.append(slug)
+            else:
+                attachments.append(name)
+        links = {}
+        if linked:
+            field_ids = dict((f.id, f.slug) for f in form_for_form.form_fields
+                             if f.slug in linked)
+            field_entries = FieldEntry.objects.filter(
+                entry=entry, field_id__in=field_ids).values_list("field_id",
+                                                                 "id")
+            for field_id, field_entry_id in field_entries:
+                url = reverse("admin:form_file", args=(field_entry_id,))
+                links[field_ids[field_id]] = request.build_absolute_uri(url)
+        return attachments, links
+
+    def send_emails(self, request, form_for_form, form, entry):
         subject = form.email_subject
         if not subject:
             subject = "%s - %s" % (form.title, entry.entry_time)
-        fields = []
-        for (k, v) in form_for_form.fields.items():
-            value = form_for_form.cleaned_data[k]
-            if isinstance(value, list):
-                value = ", ".join([i.strip() for i in value])
-            fields.append((v.label, value))
         context = {
-            "fields": fields,
+            "fields": self.get_fields(form_for_form),
             "message": form.email_message,
             "request": request,
+            "changed_fields": sorted(form_for_form.changed_fields),
         }
         email_from = form.email_from or settings.DEFAULT_FROM_EMAIL
         email_to = form_for_form.email_to()
         if email_to and form.send_email:
-            send_mail_template(subject, "form_response", email_from,
-                               email_to, context=context,
-                               fail_silently=EMAIL_FAIL_SILENTLY)
+            self.send_email(entry, "form_response", subject, email_from,
+                            [email_to], context)
         headers = None
         if email_to:
             headers = {"Reply-To": email_to}
         email_copies = split_choices(form.email_copies)
         if email_copies:
-            send_mail_template(subject, "form_response_copies", email_from,
-                               email_copies, context=context,
-                               attachments=attachments,
+            # Only the copies have the uploads, since large ones are
+            # linked to in the admin.
+            attachments, links = self.get_attachments(request,
+                                                      form_for_form, entry)
+            context["fields"] = self.get_fields(form_for_form, links)
+            self.send_email(entry, "form_response_copies", subject,
+                            email_from, email_copies, context,
+                            attachments=attachments, headers=headers)
+
+    def get_fields(self, form_for_form, links=None):
+        """
+        Return the label and value of each field for the emails, with
+        the value of uploads given in ``links`` replaced by their link.
+        """
+        links = links or {}
+        fields = []
+        for (k, v) in form_for_form.fields.items():
+            value = form_for_form.cleaned_data[k]
+            if isinstance(value, list):
+                value = ", ".join([i.strip() for i in value])
+            fields.append((v.label, links.get(k, value)))
+        return fields
+
+    def send_email(self, entry, template, subject, email_from, addr_to,
+                   context, attachments=None, headers=None):
+        """
+        Send one of the emails for the entry, or add it to the outbox
+        if ``FORMS_BUILDER_QUEUE_EMAILS`` is set. Attachments are given
+        as the names of stored uploads, which are only read from the
+        upload storage when the email is sent.
+        """
+        # The outbox needs a saved entry.
+        if QUEUE_EMAILS and entry.pk is not None:
+            EmailJob.objects.queue(entry, template, subject, email_from,
+                                   addr_to, context, attachments=attachments,
+                                   headers=headers)
+        else:
+            attachments = [attachment(name) for name in attachments or []]
+            send_mail_template(subject, template, email_from, addr_to,
+                               context=context, attachments=attachments,
                                fail_silently=EMAIL_FAIL_SILENTLY,
                                headers=headers)
 
 form_detail = login_required(FormDetail.as_view())
 
 
+class BackgroundFormDetail(FormDetail):
+    """
+    Variant of ``FormDetail`` that sends its emails from a bounded pool
+    of background threads, so that SMTP latency and failures don't hold
+    up the response.
+    """
+
+    def send_emails(self, *args):
+        send_emails = super(BackgroundFormDetail, self).send_emails
+        background.submit(send_emails, *args)
+
+background_form_detail = login_required(BackgroundFormDetail.as_view())
+
+
+class BufferedFormDetail(FormDetail):
+    """
+    Variant of ``FormDetail`` that stores submissions in a local buffer
+    rather than the database, for the ``flush_form_submissions``
+    management command to save in batches. The ``buffered_form_valid``
+    signal is sent by the command once each entry is saved, in place of
+    ``form_valid``. Emails are sent from the request even when
+    ``FORMS_BUILDER_QUEUE_EMAILS`` is set, since the outbox needs a
+    saved entry.
+    """
+
+    def save_entry(self, request, form_for_form):
+        entry = submissions.append(form_for_form)
+        if isinstance(form_for_form, PagedFormForForm):
+            form_for_form.storage.clear()
+        self.send_emails(request, form_for_form, self.form, entry)
+
+buffered_form_detail = login_required(BufferedFormDetail.as_view())
+
+
+@login_required
+def form_detail_json(request, slug):
+    """
+    Return the JSON for a form using the frontend strategy, with
+    conditional GET support based on the form's revision.
+    """
+    form = get_published_form(slug, request.user)
+    if get_form_conf_for(form.template).get("strategy") != "frontend":
+        raise Http404
+    etag = "%s-%s" % (form.id, form.revision)
+    last_modified = None
+    if form.updated is not None:
+        updated = form.updated
+        if timezone.is_naive(updated):
+            # Naive datetimes are in the default time zone when
+            # USE_TZ is off.
+            updated = timezone.make_aware(updated,
+                                          timezone.get_default_timezone())
+        last_modified = timegm(updated.utctimetuple())
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if_modified_since = parse_http_date_safe(
+        request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    if if_none_match:
+        # parse_etags() returns the tags without their quotes.
+        etags = parse_etags(if_none_match)
+        not_modified = etag in etags or "*" in etags
+    else:
+        not_modified = (if_modified_since is not None and
+                        last_modified is not None and
+                        last_modified <= if_modified_since)
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(get_form_json(form),
+                                content_type="application/json")
+    response["ETag"] = quote_etag(etag)
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
 @login_required
 def form_sent(request, slug, template="forms/form_sent.html"):
     """
     Show the response message.
     """
-    published = Form.objects.published(for_user=request.user)
-    context = {"form": get_object_or_404(published, slug=slug)}
+    context = {"form": get_published_form(slug, request.user)}
     return render_to_response(template, context, RequestContext(request))
+